@@ -0,0 +1,212 @@
+"""
+Правила эвристического оценщика рекламы (main.evaluate_ad / evaluate_ads) из ad_rules.json.
+
+Формат файла:
+- base — стартовый скор, purchase_offset — сдвиг вероятности покупки относительно клика;
+- keywords — {основа: вес}, основа ищется подстрокой в тексте без учёта регистра;
+- length — {"min", "max", "penalty"}: штраф за слишком короткий или длинный текст;
+- audience_boosts — [{"match": подстрока имени сегмента, "keywords": {основа: вес}}] —
+  надбавки, которые действуют только для подходящих сегментов;
+- segments — сегменты (persona_types), по которым считает evaluate_segments.
+
+Файл компилируется один раз в массивы NumPy; при изменении mtime перечитывается
+при следующем вызове, так что симулятор настраивается без перезапуска.
+"""
+import bisect
+import json
+import os
+import threading
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ad_rules.json")
+
+
+def stem_hits(texts: Sequence[str], stems: Sequence[str], words: bool = False) -> np.ndarray:
+    """
+    (len(texts), len(stems)) bool: есть ли основа (уже в нижнем регистре) в тексте без учёта регистра.
+    Пачка склеивается в одну строку, lower() — один вызов на всю пачку; вхождения ищутся str.find
+    по склейке и относятся к текстам по смещениям (bisect по концам текстов), так что символы
+    внутри текстов (в том числе \x00) не сдвигают границы. Вхождение через границу двух текстов не считается.
+    words=True — основа, начинающаяся с буквы, должна начинать слово («игр» не находится в «выиграй»),
+    а основа с «$» на конце — ещё и заканчивать его («хит$» не находится в «хитрый»).
+    """
+    n = len(texts)
+    hits = np.zeros((n, len(stems)), dtype=bool)
+    if not n:
+        return hits
+
+    joined = "".join(texts).lower()
+    lengths = [len(t) for t in texts]
+    if len(joined) != sum(lengths):
+        # lower() изменил длину («İ» -> «i̇») — смещения исходных текстов не годятся, снимаем регистр по одному
+        lowered = [t.lower() for t in texts]
+        joined = "".join(lowered)
+        lengths = [len(t) for t in lowered]
+    ends = list(accumulate(lengths))
+
+    for col, stem in enumerate(stems):
+        word_end = words and stem.endswith("$")
+        if word_end:
+            stem = stem[:-1]
+        word_start = words and stem[:1].isalpha()
+        if not stem:
+            hits[:, col] = True
+            continue
+        pos = joined.find(stem)
+        while pos != -1:
+            i = bisect.bisect_right(ends, pos)
+            start, end = (ends[i - 1] if i else 0), pos + len(stem)
+            if (
+                end <= ends[i]
+                and not (word_start and pos > start and joined[pos - 1].isalpha())
+                and not (word_end and end < ends[i] and joined[end].isalpha())
+            ):
+                hits[i, col] = True
+                pos = joined.find(stem, ends[i])  # в этом тексте основа уже есть — к следующему
+            else:
+                pos = joined.find(stem, pos + 1)
+    return hits
+
+
+class CompiledRules:
+    """
+    stems — все основы (общие и из audience_boosts) без повторов, по столбцу матрицы попаданий на каждую;
+    weights — общий вес каждой основы; boosts — (столбец, вес, match) в порядке файла.
+    """
+
+    def __init__(self, spec: Dict):
+        self.base = float(spec["base"])
+        self.purchase_offset = float(spec.get("purchase_offset", 0.0))
+
+        length = spec.get("length", {})
+        self.min_length = length.get("min", 0)
+        self.max_length = length.get("max", float("inf"))
+        self.length_penalty = float(length.get("penalty", 0.0))
+
+        self.stems: List[str] = []
+        columns: Dict[str, int] = {}
+
+        def column(stem: str) -> int:
+            stem = stem.lower()
+            if stem not in columns:
+                columns[stem] = len(self.stems)
+                self.stems.append(stem)
+            return columns[stem]
+
+        self.weights: List[Tuple[int, float]] = [(column(s), float(w)) for s, w in spec.get("keywords", {}).items()]
+        self.boosts: List[Tuple[int, float, str]] = [
+            (column(s), float(w), rule["match"].lower())
+            for rule in spec.get("audience_boosts", [])
+            for s, w in rule.get("keywords", {}).items()
+        ]
+        self.segments: List[str] = list(spec.get("segments", []))
+
+    def hits(self, texts: Sequence[str]) -> np.ndarray:
+        """(N, число основ) bool: есть ли основа в тексте (см. stem_hits)."""
+        return stem_hits(texts, self.stems)
+
+    def boost_mask(self, audiences: Sequence[str]) -> np.ndarray:
+        """(число надбавок, len(audiences)) bool: действует ли надбавка для сегмента."""
+        lowered = [a.lower() for a in audiences]
+        return np.array([[match in a for a in lowered] for _, _, match in self.boosts], dtype=bool).reshape(
+            len(self.boosts), len(audiences)
+        )
+
+    def score(self, texts: Sequence[str], hits: np.ndarray, boost_mask: np.ndarray) -> np.ndarray:
+        """
+        Скор до обрезки. boost_mask — (надбавки, N) или (надбавки, 1), если сегмент один на всю пачку.
+        Слагаемые складываются в порядке файла: base, keywords, штраф за длину, надбавки.
+        """
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        score = np.full(hits.shape[0], self.base)
+        for col, weight in self.weights:
+            score += np.where(hits[:, col], weight, 0.0)
+        score -= np.where((lengths < self.min_length) | (lengths > self.max_length), self.length_penalty, 0.0)
+
+        for (col, weight, _), mask in zip(self.boosts, boost_mask):
+            score = score + np.where(mask & hits[:, col], weight, 0.0)
+        return score
+
+    def probabilities(self, score: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "click_probability": np.clip(score, 0.0, 1.0),
+            "purchase_probability": np.clip(score + self.purchase_offset, 0.0, 1.0),
+        }
+
+
+class RuleEngine:
+    """
+    Держит скомпилированные правила и перекомпилирует их, когда у файла меняется mtime.
+    Если новая версия файла не читается (например, сохранена наполовину),
+    продолжаем работать на предыдущей.
+    """
+
+    def __init__(self, path: str = RULES_PATH):
+        self.path = path
+        self._mtime: Optional[float] = None
+        self._compiled: Optional[CompiledRules] = None
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self) -> CompiledRules:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._compiled is None:
+                raise
+            return self._compiled
+
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._reload(mtime)
+        return self._compiled
+
+    def _reload(self, mtime: float) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                compiled = CompiledRules(json.load(f))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            if self._compiled is None:
+                raise
+            print(f"Не удалось перечитать {self.path}, остаются прежние правила: {e}")
+        else:
+            self._compiled = compiled
+        self._mtime = mtime
+
+    def evaluate(self, texts: Sequence[str], audiences: Union[str, Sequence[str]]) -> Dict[str, np.ndarray]:
+        """
+        audiences — один сегмент на всю пачку или по сегменту на каждый текст.
+        Возвращает {"click_probability": array(N), "purchase_probability": array(N)}.
+        """
+        rules = self.rules
+        hits = rules.hits(texts)
+        if isinstance(audiences, str):
+            mask = rules.boost_mask([audiences])  # (надбавки, 1) транслируется на все тексты
+        else:
+            # сегментов всего несколько, поэтому сопоставляем каждое имя один раз
+            names = sorted(set(audiences))
+            index = {name: i for i, name in enumerate(names)}
+            mask = rules.boost_mask(names)[:, [index[a] for a in audiences]]
+        return rules.probabilities(rules.score(texts, hits, mask))
+
+    def evaluate_segments(
+        self, texts: Sequence[str], segments: Optional[Sequence[str]] = None
+    ) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """
+        Оценка каждого текста сразу для всех сегментов (по умолчанию — segments из файла):
+        тексты сканируются один раз, сегменты отличаются только надбавками.
+        Возвращает (сегменты, {"click_probability": array(N, S), "purchase_probability": array(N, S)}).
+        """
+        rules = self.rules
+        segments = list(rules.segments if segments is None else segments)
+        hits = rules.hits(texts)
+        base = rules.score(texts, hits, np.zeros((len(rules.boosts), 1), dtype=bool))
+
+        score = np.repeat(base[:, None], len(segments), axis=1)
+        for (col, weight, _), mask in zip(rules.boosts, rules.boost_mask(segments)):
+            score += np.where(hits[:, col, None] & mask[None, :], weight, 0.0)
+        return segments, rules.probabilities(score)
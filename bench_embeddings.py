@@ -0,0 +1,63 @@
+"""
+Сравнение бэкендов эмбеддингов: скорость и дрейф скоров относительно fp32 SentenceTransformer.
+
+    python bench_embeddings.py --backends fp32 torch-int8 onnx onnx-int8 > bench_output.txt
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embedding_backends import get_backend
+from embedding_store import AnchorBank
+from productAnalyzer import MODEL_NAME, SCORING_AXES
+
+
+def load_passages(paths):
+    passages = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            passages += [f"passage: {p['name']}. {p['description']}" for p in json.load(f)]
+    return passages
+
+
+def bench_backend(backend, passages, repeat, batch_size):
+    backend.load()
+    backend.encode(passages[:batch_size], batch_size=batch_size)  # прогрев
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        embeddings = backend.encode(passages, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+
+    anchors = AnchorBank(SCORING_AXES, backend.fingerprint, backend.encode)
+    scores = np.maximum(anchors.scores(embeddings) * 100 + 5, 0).mean(axis=1)
+    return len(passages) * repeat / elapsed, scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["fp32", "torch-int8", "onnx"])
+    parser.add_argument("--files", nargs="+", default=["products.json", "test.json"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    passages = load_passages(args.files)
+    print(f"Товаров: {len(passages)}, повторов: {args.repeat}\n")
+
+    _, reference = bench_backend(get_backend("fp32", MODEL_NAME), passages, 1, args.batch_size)
+    reference_top = np.argsort(-reference, kind="stable")[:3]
+
+    print(f"{'БЭКЕНД':<12} | {'ТОВАР/С':>9} | {'MAX |Δ|':>8} | {'MEAN |Δ|':>8} | {'ТОП-3 СОВПАЛ'}")
+    print("-" * 62)
+    for kind in args.backends:
+        throughput, scores = bench_backend(get_backend(kind, MODEL_NAME), passages, args.repeat, args.batch_size)
+        drift = np.abs(scores - reference)
+        same_top = np.array_equal(np.argsort(-scores, kind="stable")[:3], reference_top)
+        print(f"{kind:<12} | {throughput:>9.1f} | {drift.max():>8.3f} | {drift.mean():>8.3f} | {'да' if same_top else 'нет'}")
+
+
+if __name__ == "__main__":
+    main()
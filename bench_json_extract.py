@@ -0,0 +1,158 @@
+"""
+Фазз и бенчмарк разбора ответов LLM: json_extract против прежнего regex-разбора.
+
+На записанных «грязных» ответах проверяется, что:
+- потоковый разбор (ответ порезан на случайные куски) даёт те же варианты, что и разбор целиком;
+- оборванный ответ не роняет разбор, а отдаёт уже закрывшиеся варианты;
+- мусор до и после JSON не мешает.
+
+    python bench_json_extract.py --fuzz 2000 --repeat 2000
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from json_extract import JsonStreamExtractor, extract_variants
+
+_V1 = {"channel": "telegram", "headline": "Скидка 20% на наушники", "text": "Шумоподавление {ANC} и 30 ч работы.", "cta": "Успеть взять сейчас", "notes": "FOMO"}
+_V2 = {"channel": "telegram", "headline": "Звук \"как в студии\"", "text": "Кодек LDAC, 40 мм драйверы.", "cta": "Смотреть в каталоге", "notes": "конкретика"}
+_V3 = {"channel": "telegram", "headline": "Новинка недели", "text": "Лёгкие, 250 г. Бесплатная доставка.", "cta": "Перейти к покупке", "notes": "выгода"}
+_CLEAN = json.dumps({"variants": [_V1, _V2, _V3]}, ensure_ascii=False, indent=2)
+
+# (ответ модели, сколько вариантов должно разобраться)
+RECORDED_REPLIES = [
+    (_CLEAN, 3),
+    (f"```json\n{_CLEAN}\n```", 3),
+    (f"Вот варианты рекламы:\n\n```json\n{_CLEAN}\n```\n\nЕсли нужно, могу сделать ещё {{n}} вариантов.", 3),
+    (f"Конечно! {_CLEAN} Надеюсь, {{это}} поможет.", 3),
+    (_CLEAN.replace('"notes": "выгода"', '"notes": "выгода",').replace("}\n  ]", "},\n  ]"), 3),  # висячие запятые
+    (_CLEAN.replace('"headline": "Новинка недели"', '"headline": ""'), 2),  # один вариант не проходит схему
+    (_CLEAN.replace('"text": "Кодек LDAC, 40 мм драйверы."', '"text": ["Кодек LDAC"]'), 2),
+    (_CLEAN[: _CLEAN.index("Новинка")], 2),  # ответ оборван на третьем варианте
+    (json.dumps(_V1, ensure_ascii=False), 1),  # один вариант без обёртки
+    ("Извините, не могу выполнить запрос.", 0),
+    (f"Формат ответа: {{}}. {_CLEAN}", 3),  # пустой объект в пояснении перед JSON
+]
+
+# крайние случаи — только для фазза, в бенчмарке они перекосили бы среднее
+EDGE_REPLIES = [
+    ("{" * 3000 + "] " + _CLEAN, 3),  # тысячи ложных '{' перед JSON: разбор не должен упираться в глубину рекурсии
+]
+
+
+def legacy_extract(content):
+    """Разбор, который был в prompt.py до json_extract: regex по ```json, затем первая '{' .. последняя '}'."""
+    code_block = re.search(r"```json(.*?)```", content, flags=re.DOTALL | re.IGNORECASE)
+    if code_block:
+        return json.loads(code_block.group(1).strip())
+    start = content.find("{")
+    end = content.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        return json.loads(content[start : end + 1].strip())
+    return json.loads(content)
+
+
+def validate(raw):
+    if not raw.get("headline") or not isinstance(raw.get("text"), str) or not raw["text"]:
+        raise ValueError("не проходит схему")
+    return raw
+
+
+def legacy_count(content):
+    try:
+        return len(legacy_extract(content).get("variants", []))
+    except Exception:
+        return 0
+
+
+def stream_parse(content, rng):
+    extractor = JsonStreamExtractor(validate)
+    pos = 0
+    while pos < len(content):
+        step = rng.randint(1, 12)
+        extractor.feed(content[pos : pos + step])
+        pos += step
+    return extractor.finish().variants
+
+
+def fuzz(rounds, seed):
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(rounds):
+        reply, expected = rng.choice(RECORDED_REPLIES + EDGE_REPLIES)
+        whole = extract_variants(reply, validate).variants
+        if len(whole) != expected:
+            failures += 1
+            print(f"целиком: ждали {expected}, получили {len(whole)}: {reply[:60]!r}")
+            continue
+
+        if "variants" in reply and stream_parse(reply, rng) != whole:
+            failures += 1
+            print(f"поток разошёлся с разбором целиком: {reply[:60]!r}")
+
+        cut = reply[: rng.randint(0, len(reply))]
+        try:
+            truncated = extract_variants(cut, validate).variants
+        except Exception as e:
+            failures += 1
+            print(f"оборванный ответ уронил разбор: {e!r}")
+            continue
+        if len(truncated) > expected:
+            failures += 1
+            print(f"из оборванного ответа разобралось больше вариантов, чем из целого: {cut[-60:]!r}")
+    return failures
+
+
+def legacy_parses(content):
+    try:
+        legacy_extract(content)
+    except Exception:
+        return False
+    return True
+
+
+def bench(repeat):
+    """
+    Скорость по группам: «целые» — ответы, которые разбирает и прежний парсер (одинаковая работа),
+    «битые» — где он падает сразу, а json_extract восстанавливает варианты (работа несравнимая).
+    """
+    groups = {"целые": [], "битые": []}
+    for reply, _ in RECORDED_REPLIES:
+        groups["целые" if legacy_parses(reply) else "битые"].append(reply)
+
+    timings = {}
+    for name, parse in (("legacy", legacy_count), ("json_extract", lambda r: len(extract_variants(r, validate).variants))):
+        for group, replies in groups.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                parsed = sum(parse(r) for r in replies)
+            timings[(name, group)] = (len(replies) * repeat / (time.perf_counter() - started), parsed, len(replies))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fuzz", type=int, default=2000, help="раундов фазза")
+    parser.add_argument("--repeat", type=int, default=1000, help="проходов по корпусу в бенчмарке")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = fuzz(args.fuzz, args.seed)
+    print(f"Фазз: {args.fuzz} раундов, провалов: {failures}\n")
+
+    expected = sum(n for _, n in RECORDED_REPLIES)
+    print(f"{'РАЗБОР':<13} | {'ОТВЕТЫ':<10} | {'ОТВЕТ/С':>9} | {'ВАРИАНТОВ':>9} (всего ждём {expected})")
+    print("-" * 64)
+    for (name, group), (throughput, parsed, count) in bench(args.repeat).items():
+        print(f"{name:<13} | {group + f' ({count})':<10} | {throughput:>9.0f} | {parsed:>9}")
+    print("\njson_extract дополнительно проверяет каждый вариант схемой; на битых ответах прежний")
+    print("парсер быстро падает с нулём вариантов, а json_extract их восстанавливает — скорости там несравнимы.")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
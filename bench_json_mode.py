@@ -0,0 +1,71 @@
+"""
+Доля ответов Mistral, которые не удалось разобрать, в зависимости от response_format.
+
+Каждый провал разбора — это полная повторная генерация, поэтому сравниваем
+старый путь (только просьба в SYSTEM_PROMPT) с JSON mode и structured outputs по схеме.
+
+    python bench_json_mode.py --requests 30 --modes none json_object json_schema
+    python bench_json_mode.py --url http://127.0.0.1:8080/v1 --model qwen2.5-7b-instruct
+"""
+import argparse
+import json
+import time
+
+from prompt import DEFAULT_AUDIENCE, DEFAULT_TRENDS, MISTRAL_API_URL, MistralClient, product_from_catalog_item
+
+
+def load_payloads(path, channels, n_variants):
+    with open(path, "r", encoding="utf-8") as f:
+        products = json.load(f)
+    return [
+        {
+            "product": product_from_catalog_item(p),
+            "audience_profile": DEFAULT_AUDIENCE,
+            "channel": channel,
+            "trends": DEFAULT_TRENDS,
+            "n_variants": n_variants,
+        }
+        for p in products
+        for channel in channels
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["none", "json_object", "json_schema"])
+    parser.add_argument("--requests", type=int, default=30, help="запросов на режим")
+    parser.add_argument("--catalog", default="products.json")
+    parser.add_argument("--channels", nargs="+", default=["telegram", "vk", "yandex_ads"])
+    parser.add_argument("--n-variants", type=int, default=3)
+    parser.add_argument("--model", default="mistral-small-latest")
+    parser.add_argument("--url", help="свой OpenAI-совместимый сервер вместо Mistral API")
+    args = parser.parse_args()
+    api_url = args.url.rstrip("/") + "/chat/completions" if args.url else MISTRAL_API_URL
+
+    payloads = load_payloads(args.catalog, args.channels, args.n_variants)
+
+    print(f"{'РЕЖИМ':<12} | {'ОТВЕТОВ':>7} | {'НЕ РАЗОБРАН':>11} | {'НЕДОБОР':>7} | {'СЕК/ЗАПРОС':>10}")
+    print("-" * 60)
+    for name in args.modes:
+        mode = None if name == "none" else name
+        client = MistralClient(model=args.model, api_url=api_url, response_format=mode, api_key="bench" if args.url else None)
+
+        started = time.perf_counter()
+        for i in range(args.requests):
+            try:
+                client.generate_variants(payloads[i % len(payloads)], use_cache=False)
+            except ValueError:
+                pass  # провал разбора уже учтён в parse_stats
+
+        elapsed = (time.perf_counter() - started) / args.requests
+        used = client.active_format
+        c = client.parse_stats.counts.get(str(used), {"replies": 0, "failures": 0, "short": 0})
+        label = name if used == mode else f"{name}->{used}"  # API отверг режим
+        print(
+            f"{label:<12} | {c['replies']:>7} | {client.parse_stats.failure_rate(used):>10.1%} "
+            f"| {c['short']:>7} | {elapsed:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Пропускная способность генерации: путь Mistral (запрос на каждый payload) против
+LocalLLMClient.generate_batch (пачка payload'ов на запрос к /v1/completions).
+
+По умолчанию поднимается локальный сервер-заглушка с OpenAI-совместимыми
+/v1/chat/completions и /v1/completions. Он изображает один CPU-сервер: запросы
+обслуживаются по очереди, прогон пачки из n промптов стоит latency * (1 + batch_cost * (n - 1)).
+Так что цифры на заглушке показывают накладные расходы клиента и выигрыш от батчинга
+при заданной модели стоимости; настоящие — с --url на свой llama.cpp / vLLM.
+
+    python bench_local_llm.py --requests 48 --concurrency 4 --batch-sizes 4 16
+    python bench_local_llm.py --url http://127.0.0.1:8080/v1 --model qwen2.5-7b-instruct
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_json_mode import load_payloads
+from prompt import LocalLLMClient, MistralClient
+
+
+def _reply_content(prompt_text):
+    """Ответ заглушки: по варианту на n_variants из payload в конце промпта."""
+    n = 1
+    start = prompt_text.find('{"n_variants":')
+    if start != -1:
+        n = json.JSONDecoder().raw_decode(prompt_text, start)[0].get("n_variants", 1)
+    variants = [
+        {"channel": "telegram", "headline": f"Вариант {i + 1}", "text": "Текст объявления.", "cta": "Купить", "notes": "заглушка"}
+        for i in range(n)
+    ]
+    return json.dumps({"variants": variants}, ensure_ascii=False)
+
+
+class StandInServer:
+    def __init__(self, latency, batch_cost):
+        self.latency = latency
+        self.batch_cost = batch_cost
+        self.requests = 0
+        self._worker = threading.Lock()  # одна модель на сервере — пачки считаются по очереди
+        self._last_prompt = ""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # заголовки и тело уходят отдельными write — иначе +40 мс на delayed ACK
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path.endswith("/chat/completions"):
+                    prompts = ["\n".join(m["content"] for m in body["messages"])]
+                else:
+                    prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+                usage = server.run(prompts)
+                if self.path.endswith("/chat/completions"):
+                    choices = [{"index": 0, "message": {"role": "assistant", "content": _reply_content(prompts[0])}}]
+                else:
+                    choices = [{"index": i, "text": _reply_content(p)} for i, p in enumerate(prompts)]
+                out = json.dumps({"choices": choices, "usage": usage}, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def run(self, prompts):
+        with self._worker:
+            self.requests += 1
+            # «токены» — символы / 3; кэшированным считается префикс, общий с предыдущим промптом
+            cached = 0
+            for p in prompts:
+                cached += len(os.path.commonprefix([self._last_prompt, p])) // 3
+                self._last_prompt = p
+            time.sleep(self.latency * (1 + self.batch_cost * (len(prompts) - 1)))
+        return {"prompt_tokens": sum(len(p) // 3 for p in prompts), "prompt_tokens_details": {"cached_tokens": cached}}
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def run_mode(label, generate, payloads, server):
+    before = server.requests if server else 0
+    started = time.perf_counter()
+    results = generate(payloads)
+    elapsed = time.perf_counter() - started
+    requests = server.requests - before if server else None
+    return label, len(payloads) / elapsed, requests, sum(len(r) for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="свой OpenAI-совместимый сервер; без него — заглушка")
+    parser.add_argument("--model", default="local")
+    parser.add_argument("--requests", type=int, default=48, help="payload'ов на режим")
+    parser.add_argument("--concurrency", type=int, default=4, help="потоков для пути Mistral")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--latency", type=float, default=0.05, help="заглушка: секунд на прогон одного промпта")
+    parser.add_argument("--batch-cost", type=float, default=0.15, help="заглушка: доля latency за каждый лишний промпт в пачке")
+    parser.add_argument("--catalog", default="products.json")
+    parser.add_argument("--channels", nargs="+", default=["telegram", "vk", "yandex_ads"])
+    parser.add_argument("--n-variants", type=int, default=3)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.catalog, args.channels, args.n_variants)
+    payloads = (payloads * (args.requests // max(len(payloads), 1) + 1))[: args.requests]
+
+    server = None if args.url else StandInServer(args.latency, args.batch_cost)
+    base_url = args.url or server.url
+
+    # путь Mistral: тот же MistralClient, что ходит в api.mistral.ai, но на локальный chat/completions
+    mistral = MistralClient(model=args.model, api_url=base_url.rstrip("/") + "/chat/completions", api_key="bench")
+
+    def mistral_sequential(items):
+        return [mistral.generate_variants(p, use_cache=False) for p in items]
+
+    def mistral_threads(items):
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            return list(pool.map(lambda p: mistral.generate_variants(p, use_cache=False), items))
+
+    modes = [
+        ("mistral x1", mistral_sequential),
+        (f"mistral x{args.concurrency}", mistral_threads),
+    ]
+    local_clients = {}
+    for size in args.batch_sizes:
+        local_clients[size] = LocalLLMClient(model=args.model, base_url=base_url, max_batch_size=size)
+        modes.append((f"local batch {size}", lambda items, c=local_clients[size]: c.generate_batch(items, use_cache=False)))
+
+    print(f"{'РЕЖИМ':<16} | {'PAYLOAD/С':>9} | {'HTTP-ЗАПРОСОВ':>13} | {'ВАРИАНТОВ':>9}")
+    print("-" * 58)
+    try:
+        for label, generate in modes:
+            label, throughput, requests, variants = run_mode(label, generate, payloads, server)
+            requests = "-" if requests is None else requests
+            print(f"{label:<16} | {throughput:>9.1f} | {requests:>13} | {variants:>9}")
+    finally:
+        if server is not None:
+            server.close()
+
+    print()
+    print(f"mistral: {mistral.prefix_stats.summary()}")
+    for size, client in local_clients.items():
+        print(f"local batch {size}: {client.prefix_stats.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Массовая генерация креативов по всему каталогу: товары × аудитории × каналы.
+
+Результаты пишутся в JSON Lines по мере готовности; файл результатов одновременно
+является чекпоинтом — при повторном запуске уже успешно сгенерированные задачи пропускаются.
+
+    python bulk_generation.py best_products.json --out creatives.jsonl --concurrency 32
+    python bulk_generation.py best_products.json --backend local --batch-size 64
+
+С --backend local задачи уходят на свой сервер (LOCAL_LLM_URL) пачками через generate_batch.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from catalog_reader import iter_chunks, iter_products
+from llm_resilience import ResilientLLMClient
+from prompt import (
+    DEFAULT_AUDIENCE,
+    DEFAULT_TRENDS,
+    AdGenerator,
+    AsyncMistralClient,
+    MockLLMClient,
+    get_llm_client,
+    product_from_catalog_item,
+)
+
+CHANNELS = ["telegram", "vk", "yandex_ads"]
+
+
+def job_key(input_json: Dict[str, Any]) -> str:
+    """
+    Ключ задачи — хэш её содержимого, поэтому он не зависит от порядка товаров в каталоге.
+    """
+    canonical = json.dumps(input_json, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def iter_jobs(
+    records: Iterable[Dict[str, Any]],
+    channels: List[str],
+    audiences: Dict[str, Dict[str, Any]],
+    trends: List[str],
+    n_variants: int,
+) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Раскладывает записи каталога на задачи (key, имя аудитории, input_json для AdGenerator).
+    Записи в формате {"product": ...} берутся как есть, остальные — как товары каталога.
+    """
+    for record in records:
+        product = record["product"] if "product" in record else product_from_catalog_item(record)
+        for audience_name, audience in audiences.items():
+            for channel in channels:
+                input_json = {
+                    "product": product,
+                    "audience_profile": audience,
+                    "channel": channel,
+                    "trends": trends,
+                    "n_variants": n_variants,
+                }
+                yield job_key(input_json), audience_name, input_json
+
+
+def load_done_keys(out_path: str) -> Set[str]:
+    """
+    Читает уже записанные результаты. Недописанную последнюю строку (падение посреди записи)
+    обрезаем, чтобы дописывание продолжилось с чистой строки.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+
+    good_size = 0
+    with open(out_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            good_size += len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # чужие и неполные строки (без ключа) пропускаем — такие задачи просто выполнятся заново;
+            # ответы запасного клиента тоже не считаются готовыми
+            key = record.get("key") if isinstance(record, dict) else None
+            if isinstance(key, str) and "error" not in record and not record.get("fallback"):
+                done.add(key)
+
+    if good_size < os.path.getsize(out_path):
+        with open(out_path, "r+b") as f:
+            f.truncate(good_size)
+    return done
+
+
+def _write_record(
+    out,
+    stats: Dict[str, int],
+    key: str,
+    audience_name: str,
+    input_json: Dict[str, Any],
+    result: Optional[Dict[str, Any]] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    record: Dict[str, Any] = {"key": key, "audience": audience_name, "input": input_json}
+    if error is not None:
+        record["error"] = str(error)
+        stats["failed"] += 1
+    else:
+        record["variants"] = result["variants"]
+        if any(v.get("fallback") for v in result["variants"]):
+            record["fallback"] = True
+            stats["fallback"] += 1
+        else:
+            stats["ok"] += 1
+
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+async def run_bulk(
+    generator: AdGenerator,
+    jobs: Iterable[Tuple[str, str, Dict[str, Any]]],
+    out_path: str,
+    concurrency: int = 16,
+    resume: bool = True,
+) -> Dict[str, int]:
+    """
+    Гоняет задачи через generator не более чем в concurrency потоков,
+    каждую готовую строку сразу дописывает в out_path.
+    Ошибки тоже пишутся (с полем "error") и при следующем запуске повторяются,
+    как и ответы запасного клиента (помечены "fallback": true).
+    """
+    done = load_done_keys(out_path) if resume else set()
+    stats = {"ok": 0, "failed": 0, "skipped": 0, "fallback": 0}
+    jobs_iter = iter(jobs)
+
+    with open(out_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        async def worker() -> None:
+            # воркеры делят один итератор, так что задачи не материализуются списком
+            for key, audience_name, input_json in jobs_iter:
+                if key in done:
+                    stats["skipped"] += 1
+                    continue
+                done.add(key)
+
+                try:
+                    result = await generator.agenerate_from_json_dict(input_json, return_human_texts=False)
+                except Exception as e:
+                    _write_record(out, stats, key, audience_name, input_json, error=e)
+                else:
+                    _write_record(out, stats, key, audience_name, input_json, result=result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return stats
+
+
+def run_bulk_batched(
+    generator: AdGenerator,
+    jobs: Iterable[Tuple[str, str, Dict[str, Any]]],
+    out_path: str,
+    batch_size: int = 64,
+    resume: bool = True,
+) -> Dict[str, int]:
+    """
+    То же, что run_bulk, но задачи идут чанками по batch_size через
+    generator.generate_batch_from_json_dicts — для клиентов с generate_batch (LocalLLMClient),
+    которые сами режут чанк на пачки по max_batch_size. Если чанк упал целиком,
+    ошибка пишется в каждую его задачу.
+    """
+    done = load_done_keys(out_path) if resume else set()
+    stats = {"ok": 0, "failed": 0, "skipped": 0, "fallback": 0}
+
+    with open(out_path, "a" if resume else "w", encoding="utf-8") as out:
+        for chunk in iter_chunks(jobs, batch_size):
+            todo = []
+            for key, audience_name, input_json in chunk:
+                if key in done:
+                    stats["skipped"] += 1
+                    continue
+                done.add(key)
+                todo.append((key, audience_name, input_json))
+            if not todo:
+                continue
+
+            try:
+                results = generator.generate_batch_from_json_dicts([job[2] for job in todo], return_human_texts=False)
+            except Exception as e:
+                for key, audience_name, input_json in todo:
+                    _write_record(out, stats, key, audience_name, input_json, error=e)
+                continue
+            for (key, audience_name, input_json), result in zip(todo, results):
+                _write_record(out, stats, key, audience_name, input_json, result=result)
+
+    return stats
+
+
+async def _main(args: argparse.Namespace) -> None:
+    audiences = {"default": DEFAULT_AUDIENCE}
+    if args.audiences:
+        with open(args.audiences, "r", encoding="utf-8") as f:
+            audiences = json.load(f)
+
+    jobs = iter_jobs(iter_products(args.catalog), args.channels, audiences, args.trends, args.n_variants)
+
+    backend = "mock" if args.mock else args.backend
+    client: Optional[AsyncMistralClient] = None
+    local = None
+    if backend == "mock":
+        generator = AdGenerator(MockLLMClient())
+    elif backend == "local":
+        # LocalLLMClient в ResilientLLMClient; ответы запасного клиента помечаются fallback и повторятся при следующем запуске
+        local = get_llm_client(backend="local")
+        generator = AdGenerator(local)
+    else:
+        client = AsyncMistralClient(max_concurrency=args.concurrency)
+        # без fallback: заглушки в креативах не нужны, упавшие задачи повторятся при следующем запуске
+        generator = AdGenerator(ResilientLLMClient(client))
+
+    try:
+        if local is not None:
+            # синхронный клиент — в отдельном потоке, чтобы не держать event loop
+            stats = await asyncio.to_thread(
+                run_bulk_batched, generator, jobs, args.out, batch_size=args.batch_size, resume=not args.restart
+            )
+        else:
+            stats = await run_bulk(generator, jobs, args.out, concurrency=args.concurrency, resume=not args.restart)
+    finally:
+        if client is not None:
+            await client.aclose()
+        if local is not None:
+            local.primary.close()
+
+    print(
+        f"Готово: {stats['ok']}, запасных ответов: {stats['fallback']}, ошибок: {stats['failed']}, "
+        f"пропущено (уже было): {stats['skipped']}"
+    )
+    if client is not None:
+        print(client.prefix_stats.summary())
+    elif local is not None:
+        print(local.primary.prefix_stats.summary())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Массовая генерация креативов по каталогу")
+    parser.add_argument("catalog", help="каталог (.json / .jsonl / .csv) или best_products.json")
+    parser.add_argument("--out", default="creatives.jsonl")
+    parser.add_argument("--channels", nargs="+", default=CHANNELS)
+    parser.add_argument("--audiences", help="JSON {имя: audience_profile}; по умолчанию одна аудитория")
+    parser.add_argument("--trends", nargs="+", default=DEFAULT_TRENDS)
+    parser.add_argument("--n-variants", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--backend", choices=["mistral", "local", "mock"], default="mistral",
+                        help="local — свой OpenAI-совместимый сервер (LOCAL_LLM_URL), пачками через generate_batch")
+    parser.add_argument("--batch-size", type=int, default=64, help="задач на вызов generate_batch (--backend local)")
+    parser.add_argument("--mock", action="store_true", help="то же, что --backend mock")
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя чекпоинт")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,99 @@
+import csv
+import json
+import os
+from itertools import islice
+
+NUMERIC_FIELDS = ("price", "market_cost")
+
+
+def iter_products(path, read_size=1 << 16):
+    """
+    Потоково читает каталог товаров: JSON-массив, JSON Lines (.jsonl/.ndjson) или CSV.
+    Товары отдаются по одному, файл целиком в память не загружается. BOM в начале файла пропускается.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        yield from _iter_json_lines(path)
+    elif ext == ".csv":
+        yield from _iter_csv(path)
+    else:
+        yield from _iter_json_array(path, read_size)
+
+
+def iter_chunks(items, size):
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_json_lines(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _to_number(value):
+    # пустая или нечисловая ячейка CSV — None, а не строка, которую потом сравнят с числом
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _iter_csv(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            for field in NUMERIC_FIELDS:
+                if field in row:
+                    row[field] = _to_number(row[field])
+            yield row
+
+
+def _iter_json_array(path, read_size):
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf = f.read(read_size).lstrip()
+        if not buf.startswith("["):
+            # не массив (например, один объект) — такой файл читаем целиком
+            data = json.loads(buf + f.read())
+            yield from (data if isinstance(data, list) else [data])
+            return
+
+        pos = 1
+        eof = False
+        while True:
+            # пропускаем пробелы и запятые между элементами
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+
+            if pos < len(buf) and buf[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # элемент не влез в буфер целиком — дочитываем
+                if eof:
+                    raise
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            if not eof and (end == len(buf) or buf[end] in ".eE+-"):
+                # число на границе чтения разбирается как законченное («23» из «23456», «1.5» из «1.5e10») —
+                # дочитываем и разбираем заново
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            yield item
+            pos = end
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    Дисковый кэш эмбеддингов товаров.
+    embeddings.f32 — плоская float32-матрица (читается через memmap),
+    keys.txt — sha1(текст) по строке на строку матрицы (только дописывается),
+    index.json — модель и размерность (переписывается атомарно, только при сбросе и первой записи).
+    Если модель в индексе не совпадает с текущей, кэш сбрасывается.
+    """
+
+    def __init__(self, cache_dir, model_name):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.matrix_path = os.path.join(cache_dir, "embeddings.f32")
+        self.keys_path = os.path.join(cache_dir, "keys.txt")
+        self.index_path = os.path.join(cache_dir, "index.json")
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = None
+
+        if not meta or meta.get("model") != self.model_name:
+            self._reset()
+            return
+
+        self.dim = meta["dim"]
+        if "rows" in meta:
+            # старый формат: все ключи внутри index.json — переносим в keys.txt
+            keys = sorted(meta["rows"], key=meta["rows"].get)
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.writelines(k + "\n" for k in keys)
+            self._save_index()
+        self.rows = self._read_keys()
+
+        # матрица пишется раньше ключей: если прошлый запуск упал между ними — отрезаем лишние строки
+        expected_size = len(self.rows) * (self.dim or 0) * 4
+        if not os.path.exists(self.matrix_path) or os.path.getsize(self.matrix_path) < expected_size:
+            self._reset()
+        elif os.path.getsize(self.matrix_path) > expected_size:
+            with open(self.matrix_path, "r+b") as f:
+                f.truncate(expected_size)
+
+    def _read_keys(self):
+        try:
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        complete = data[: data.rfind("\n") + 1]  # недописанная последняя строка — обрыв записи
+        if len(complete) < len(data):
+            with open(self.keys_path, "r+b") as f:
+                f.truncate(len(complete.encode("utf-8")))
+        return {key: row for row, key in enumerate(complete.splitlines())}
+
+    def _reset(self):
+        self.dim = None
+        self.rows = {}
+        open(self.matrix_path, "wb").close()
+        open(self.keys_path, "wb").close()
+        self._save_index()
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _matrix(self):
+        if not self.rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+
+    def _append(self, keys, vectors):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._save_index()
+
+        # сначала матрица, потом ключи: ключ без строки матрицы не появится даже при обрыве
+        with open(self.matrix_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.writelines(k + "\n" for k in keys)
+
+        start = len(self.rows)
+        for offset, key in enumerate(keys):
+            self.rows[key] = start + offset
+
+    def __len__(self):
+        return len(self.rows)
+
+    def has_all(self, texts):
+        return all(self._key(t) in self.rows for t in texts)
+
+    def get_or_encode(self, texts, encode):
+        """
+        Возвращает матрицу (len(texts), dim) в порядке texts.
+        encode(list_of_texts) вызывается только для текстов, которых ещё нет в кэше.
+        """
+        keys = [self._key(t) for t in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            self._append(list(missing), vectors)
+
+        return np.asarray(self._matrix()[[self.rows[k] for k in keys]])
+
+    def lookup(self, texts):
+        """
+        Для кодирования в другом процессе: (индексы найденных в кэше текстов, их матрица или None,
+        индексы отсутствующих). Закодированные отсутствующие дописываются через add.
+        """
+        keys = [self._key(t) for t in texts]
+        found = [i for i, key in enumerate(keys) if key in self.rows]
+        missing = [i for i, key in enumerate(keys) if key not in self.rows]
+        vectors = np.asarray(self._matrix()[[self.rows[keys[i]] for i in found]]) if found else None
+        return found, vectors, missing
+
+    def add(self, texts, vectors):
+        """Дописывает эмбеддинги texts; уже известные и повторяющиеся тексты пропускаются."""
+        new = {}
+        for text, vector in zip(texts, vectors):
+            key = self._key(text)
+            if key not in self.rows and key not in new:
+                new[key] = vector
+        if new:
+            self._append(list(new), np.asarray(list(new.values()), dtype=np.float32))
+
+
+class AnchorBank:
+    """
+    Якорные векторы для осей скоринга: одна нормированная матрица
+    со строками [pos_1, neg_1, pos_2, neg_2, ...] в порядке осей.
+    Кэшируется в anchors.npz вместе с отпечатком (модель + тексты якорей),
+    поэтому при старте модель кодирует якоря, только если что-то поменялось.
+    """
+
+    def __init__(self, axes, model_name, encode, cache_dir=None):
+        self.names = list(axes)
+
+        fingerprint = hashlib.sha1(
+            json.dumps({"model": model_name, "axes": axes}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        path = os.path.join(cache_dir, "anchors.npz") if cache_dir else None
+
+        self.matrix = self._load(path, fingerprint)
+        if self.matrix is None:
+            texts = []
+            for pos, neg in axes.values():
+                texts += [f"query: {pos}", f"query: {neg}"]
+            self.matrix = _normalize(np.asarray(encode(texts), dtype=np.float32))
+
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez(path, fingerprint=fingerprint, matrix=self.matrix)
+
+    @staticmethod
+    def _load(path, fingerprint):
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            return data["matrix"]
+
+    def scores(self, embeddings):
+        """
+        (N, dim) эмбеддингов -> (N, число осей): cos(pos) - cos(neg) по каждой оси.
+        Все оси считаются одним матричным умножением.
+        """
+        sims = _normalize(embeddings) @ self.matrix.T
+        return sims[:, 0::2] - sims[:, 1::2]
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
@@ -1,9 +1,14 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
+import argparse
+import asyncio
 import json
 import os
+import re
+import time
+from typing import Dict, List, Optional
 
-from feedback_helper import generate_prompt
+from feedback_helper import TOKENS_ESTIMATED, build_prompt, generate_prompt
 
 load_dotenv()
 openAI_client = OpenAI(
@@ -29,10 +34,32 @@ persona_types = [
     "culturally_engaged_creatives"
 ]
 
+_PROBABILITY_RE = re.compile(r"(click_probability|purchase_probability)\s*:\s*([0-9]*[.,]?[0-9]+)")
+
+
+def parse_probabilities(text: str) -> Dict[str, Optional[float]]:
+    """
+    Вытаскивает из ответа модели две строки формата промпта:
+    click_probability: <число>, purchase_probability: <число>.
+    """
+    result: Dict[str, Optional[float]] = {"click_probability": None, "purchase_probability": None}
+    for name, value in _PROBABILITY_RE.findall(text or ""):
+        result[name] = min(1.0, max(0.0, float(value.replace(",", "."))))
+    return result
+
 
 class AdTest:
-    def __init__(self, model="gpt-4o-mini-2024-07-18"):
+    """
+    run_test — один промпт на выбранные сегменты и один ответ;
+    run_segments — по промпту на каждый сегмент, запросы идут параллельно
+    (не больше max_concurrency одновременно), итог — таблица по сегментам.
+    token_budget — потолок токенов на промпт: большие сегменты урезаются стратифицированной выборкой.
+    """
+
+    def __init__(self, model="gpt-4o-mini-2024-07-18", max_concurrency: int = 15, token_budget: Optional[int] = None):
         self.model = model
+        self.max_concurrency = max_concurrency
+        self.token_budget = token_budget
 
 
     def _get_result(self, message) -> str:
@@ -46,7 +73,7 @@ class AdTest:
     def run_test(self, ad: str, types: list[str]) -> tuple[str, str]:
         result = []
 
-        prompt = generate_prompt(ad, types)
+        prompt = generate_prompt(ad, types, self.token_budget)
         print("\n\n\nel proompt type:\n\n\n", type(prompt))
         prompt_result = self._get_result(prompt)
 
@@ -56,15 +83,103 @@ class AdTest:
         return result
 
 
+    async def _aget_result(self, client: AsyncOpenAI, message: str, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            completion = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": message}]
+            )
+        return completion.choices[0].message.content
+
+
+    async def run_segments(self, ad: str, types: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Оценивает рекламу по каждому сегменту отдельно и параллельно.
+        Возвращает {сегмент: {"click_probability", "purchase_probability"}};
+        если запрос по сегменту упал — {"error": текст ошибки}, остальные сегменты не страдают.
+        """
+        types = list(types or persona_types)
+        prompts = [build_prompt(ad, [t], self.token_budget) for t in types]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # клиент живёт в рамках одного event loop: его соединения привязаны к loop,
+        # и после asyncio.run следующий вызов получил бы «Event loop is closed»
+        async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) as client:
+            replies = await asyncio.gather(
+                *(self._aget_result(client, p["prompt"], semaphore) for p in prompts),
+                return_exceptions=True,
+            )
+
+        table = {}
+        for segment, prompt, reply in zip(types, prompts, replies):
+            if isinstance(reply, Exception):
+                table[segment] = {"error": str(reply)}
+            else:
+                table[segment] = parse_probabilities(reply)
+            table[segment].update(
+                prompt_tokens=prompt["tokens"], tokens_estimated=prompt["tokens_estimated"], personas=prompt["personas"]
+            )
+        return table
+
+
+    def run_segments_sequential(self, ad: str, types: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        То же, что run_segments, но сегменты по очереди через синхронный клиент — для сравнения времени.
+        """
+        table = {}
+        for segment in types or persona_types:
+            prompt = build_prompt(ad, [segment], self.token_budget)
+            try:
+                table[segment] = parse_probabilities(self._get_result(prompt["prompt"]))
+            except Exception as e:
+                table[segment] = {"error": str(e)}
+            table[segment].update(
+                prompt_tokens=prompt["tokens"], tokens_estimated=prompt["tokens_estimated"], personas=prompt["personas"]
+            )
+        return table
+
+
+def print_table(table: Dict[str, Dict]) -> None:
+    print(f"{'СЕГМЕНТ':<40} | {'КЛИК':>6} | {'ПОКУПКА':>7} | {'ТОКЕНОВ':>7} | {'ПЕРСОН':>6}")
+    print("-" * 80)
+    for segment, scores in table.items():
+        prefix = f"{segment:<40} | "
+        if "error" in scores:
+            print(f"{prefix}ошибка: {scores['error'][:60]}")
+            continue
+        cells = [f"{v:.3f}" if v is not None else "—" for v in (scores["click_probability"], scores["purchase_probability"])]
+        print(f"{prefix}{cells[0]:>6} | {cells[1]:>7} | {scores['prompt_tokens']:>7} | {scores['personas']:>6}")
+    if TOKENS_ESTIMATED:
+        print("ТОКЕНОВ — оценка по символам: tiktoken не установлен (pip install tiktoken)")
+
+
 
 if __name__ == "__main__":
-    tester = AdTest()
+    parser = argparse.ArgumentParser(description="Оценка рекламы на синтетических сегментах")
+    parser.add_argument("--segments", nargs="+", default=persona_types, help="по умолчанию все 15 сегментов")
+    parser.add_argument("--concurrency", type=int, default=15)
+    parser.add_argument("--compare", action="store_true", help="прогнать и последовательный путь, сравнить время")
+    parser.add_argument("--token-budget", type=int, help="потолок токенов на промпт сегмента")
+    parser.add_argument("--json", action="store_true", help="вывести таблицу в JSON")
+    args = parser.parse_args()
+
+    tester = AdTest(max_concurrency=args.concurrency, token_budget=args.token_budget)
 
     test_ad = """iPhone 17 — твой следующий уровень технологий!
 Ощути невероятную скорость, улучшенную камеру и долгий срок работы батареи.
 💥 Скидка 10% только сегодня!"""
 
-    result = tester.run_test(test_ad, ["low_income_pragmatic_youth"])
-
-    print(result[0])
-    print(result[1])
\ No newline at end of file
+    started = time.perf_counter()
+    table = asyncio.run(tester.run_segments(test_ad, args.segments))
+    parallel_time = time.perf_counter() - started
+
+    if args.json:
+        print(json.dumps(table, ensure_ascii=False, indent=2))
+    else:
+        print_table(table)
+    print(f"\nПараллельно: {parallel_time:.1f} с на {len(args.segments)} сегментов")
+
+    if args.compare:
+        started = time.perf_counter()
+        tester.run_segments_sequential(test_ad, args.segments)
+        sequential_time = time.perf_counter() - started
+        print(f"Последовательно: {sequential_time:.1f} с (ускорение ×{sequential_time / parallel_time:.1f})")
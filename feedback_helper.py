@@ -1,7 +1,6 @@
 import json
 
-with open('categorized_personas.json', 'r', encoding='utf-8') as f:
-    parsed = json.load(f) 
+from persona_store import get_store
 
 ad = """iPhone 17 — твой следующий уровень технологий!
 Ощути невероятную скорость, улучшенную камеру и долгий срок работы батареи.
@@ -34,15 +33,142 @@ PROMPT END
 """
 
 
-def generate_prompt(ad, target_audiences):
-    for target_audience in target_audiences:
-        people = parsed[target_audience]
-        people_json = json.dumps(people, ensure_ascii=False, indent=2)
+# ==========================
+# Компактная запись персон
+# ==========================
 
-    final = promt.format(people_json, ad)
-    
-    return final
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # токенизатор gpt-4o / gpt-4o-mini
+except ImportError:
+    _ENCODING = None
+
+# Без tiktoken токены промптов — оценка по символам, бюджеты и отчёты об этом предупреждают
+TOKENS_ESTIMATED = _ENCODING is None
+
+# Поля-перечисления кодируются номерами по легенде, которая печатается один раз на промпт
+_ENUM_FIELDS = [
+    ("preferred_channel", "канал"),
+    ("interests", "интересы"),
+    ("behaviors", "поведение"),
+]
+_GENDER_CODES = {"male": "м", "female": "ж", "prefer_not_to_say": "-"}
+
+
+def count_tokens(text):
+    """
+    Число токенов промпта. Без tiktoken — оценка по символам
+    (кириллица и JSON-разметка дают около 3 символов на токен).
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 3 + 1
+
+
+def encode_personas_compact(people):
+    """
+    Таблица без отступов и повторяющихся ключей: легенда кодов + по строке на персону
+    "возраст|пол|соцстатус|канал|интересы|поведение|ценовая чувствительность".
+    """
+    codes = {field: {} for field, _ in _ENUM_FIELDS}
+    for p in people:
+        for field, _ in _ENUM_FIELDS:
+            values = p.get(field) or []
+            for value in ([values] if isinstance(values, str) else values):
+                codes[field].setdefault(value, len(codes[field]) + 1)
+
+    lines = ["Легенда кодов:"]
+    for field, title in _ENUM_FIELDS:
+        lines.append(f"{title}: " + ", ".join(f"{code}={value}" for value, code in codes[field].items()))
+    lines.append("пол: м=male, ж=female, -=не указан")
+    lines.append("возраст|пол|соцстатус|канал|интересы|поведение|ценовая_чувствительность")
+
+    for p in people:
+        interests = ",".join(str(codes["interests"][v]) for v in p.get("interests", []))
+        behaviors = ",".join(str(codes["behaviors"][v]) for v in p.get("behaviors", []))
+        lines.append("|".join([
+            p.get("age_range", ""),
+            _GENDER_CODES.get(p.get("gender"), "-"),
+            p.get("social", ""),
+            str(codes["preferred_channel"].get(p.get("preferred_channel"), "")),
+            interests,
+            behaviors,
+            f"{p.get('price_sensitivity', 0.5):.2f}",
+        ]))
+    return "\n".join(lines)
+
+
+def _spread(people, k):
+    """
+    k персон из сегмента, равномерно по отсортированному списку (соцстатус, возраст, ценовая чувствительность) —
+    стратифицированная выборка без случайности, распределения сегмента сохраняются.
+    """
+    if k >= len(people):
+        return list(people)
+    ordered = sorted(people, key=lambda p: (p.get("social", ""), p.get("age_range", ""), p.get("price_sensitivity", 0)))
+    step = len(ordered) / k
+    return [ordered[int(i * step + step / 2)] for i in range(k)]
+
+
+def sample_personas(segments, n):
+    """
+    n персон из нескольких сегментов: пропорционально размеру сегмента, не меньше одной на сегмент.
+    """
+    total = sum(len(people) for people in segments.values())
+    if n >= total:
+        return [p for people in segments.values() for p in people]
+    sample = []
+    for people in segments.values():
+        sample.extend(_spread(people, max(1, round(n * len(people) / total))))
+    return sample
+
+
+def build_prompt(ad, target_audiences, token_budget=None, compact=True):
+    """
+    Собирает промпт по сегментам target_audiences.
+    token_budget — потолок токенов промпта: если все персоны не влезают, берётся
+    стратифицированная выборка такого размера, чтобы уложиться.
+    Возвращает {"prompt", "tokens", "tokens_estimated", "personas", "personas_total"}.
+    """
+    store = get_store()
+    segments = {t: store.segment(t) for t in target_audiences}
+    total = sum(len(people) for people in segments.values())
+
+    def render(people):
+        if compact:
+            return promt.format(encode_personas_compact(people), ad)
+        return promt.format(json.dumps(people, ensure_ascii=False, indent=2), ad)
+
+    people = sample_personas(segments, total)
+    prompt = render(people)
+    tokens = count_tokens(prompt)
+
+    if token_budget is not None:
+        # стоимость строки персоны оцениваем по полному промпту и уточняем, пока не влезем
+        fixed = count_tokens(render([]))
+        n = total
+        while tokens > token_budget and n > len(segments):
+            per_person = max((tokens - fixed) / max(len(people), 1), 1e-9)
+            n = min(n - 1, max(len(segments), int((token_budget - fixed) / per_person)))
+            people = sample_personas(segments, n)
+            prompt = render(people)
+            tokens = count_tokens(prompt)
+
+    return {"prompt": prompt, "tokens": tokens, "tokens_estimated": TOKENS_ESTIMATED,
+            "personas": len(people), "personas_total": total}
+
+
+def generate_prompt(ad, target_audiences, token_budget=None, compact=True):
+    # персоны всех выбранных сегментов, а не только последнего
+    return build_prompt(ad, target_audiences, token_budget, compact)["prompt"]
 
     
 if __name__ == "__main__":
-    generate_prompt(ad,['low_income_pragmatic_youth'])
\ No newline at end of file
+    for segment in ["low_income_pragmatic_youth", "health_wellness_enthusiasts"]:
+        legacy = build_prompt(ad, [segment], compact=False)
+        compact = build_prompt(ad, [segment])
+        budgeted = build_prompt(ad, [segment], token_budget=1500)
+        print(f"{segment}: json {legacy['tokens']} ток., компактно {compact['tokens']} ток., "
+              f"бюджет 1500 -> {budgeted['tokens']} ток. ({budgeted['personas']} из {budgeted['personas_total']} персон)")
+    if TOKENS_ESTIMATED:
+        print("tiktoken не установлен: токены — оценка по символам (pip install tiktoken)")
\ No newline at end of file
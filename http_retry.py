@@ -0,0 +1,36 @@
+import math
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# 429 — упёрлись в квоту, 5xx — временные проблемы на стороне сервиса
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """
+    Экспоненциальная задержка с полным джиттером: случайное число от 0 до min(cap, base * 2^attempt).
+    Джиттер нужен, чтобы параллельные запросы не повторялись одной волной.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(response):
+    """
+    Читает заголовок Retry-After (секунды или HTTP-дата). None, если заголовка нет или он кривой.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(0.0, seconds) if math.isfinite(seconds) else None
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
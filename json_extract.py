@@ -0,0 +1,287 @@
+"""
+Устойчивое извлечение JSON из ответа LLM за один проход.
+
+JsonStreamExtractor принимает текст кусками (целиком или по мере прихода SSE-дельт):
+- пропускает всё до первой '{' (пояснения, ```json и т.п.) и всё после того,
+  как корневой объект закрылся (хвостовой мусор);
+- скобки внутри строк и экранированные кавычки не сбивают подсчёт глубины;
+- висячие запятые перед '}' / ']' выбрасываются на лету;
+- каждый объект из массива "variants" корневого объекта отдаётся, как только закрылся,
+  и проверяется отдельно — один битый вариант не роняет весь ответ;
+- объект без "variants" и "headline" ({} или {n} в пояснении) корнем не считается, поиск идёт дальше.
+"""
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+VARIANTS_KEY = "variants"
+NO_VARIANTS_ERROR = "в корневом объекте нет вариантов"
+
+_STRUCTURAL = re.compile(r'[{}\[\]",]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder()
+
+
+class ExtractError(ValueError):
+    """Из ответа модели не удалось достать ни одного годного варианта (имеет смысл перегенерировать)."""
+
+
+@dataclass
+class ExtractResult:
+    """
+    variants — варианты, прошедшие validate;
+    errors — почему остальные варианты (или ответ целиком) отброшены;
+    complete — корневой объект закрылся;
+    data — сам корневой объект, если в нём не нашлось массива "variants".
+    """
+    variants: List[Any] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    complete: bool = False
+    data: Optional[Dict[str, Any]] = None
+
+
+class JsonStreamExtractor:
+    """
+    validate(dict) превращает сырой вариант в объект результата или бросает ValueError.
+    feed(chunk) возвращает варианты, которые закрылись в этом куске; finish() — итог.
+    """
+
+    def __init__(self, validate: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.validate = validate or (lambda v: v)
+        self.result = ExtractResult()
+        self._replay: Optional[str] = None  # уже прочитанный текст, который надо разобрать заново (см. _fail_root)
+        self._skipped_root = False  # попадался закрытый объект без вариантов
+        self._reset_root()
+
+    def _reset_root(self) -> None:
+        self._buf: List[str] = []          # текст корневого объекта (без висячих запятых)
+        self._stack: List[str] = []        # открытые '{' / '['
+        self._opened_at: List[int] = []    # позиции открытых скобок в _buf
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._pending_comma: Optional[int] = None
+        self._root_key: Optional[str] = None   # последняя строка на верхнем уровне — кандидат в ключ
+        self._array_key: Optional[str] = None  # ключ массива, открытого на верхнем уровне
+        self._variant_start = 0
+        self._saw_variants = False
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        ready: List[Any] = []
+        self._consume(chunk, ready)
+        return ready
+
+    def _consume(self, text: str, ready: List[Any]) -> None:
+        # прыгаем regex-поиском от одного значимого символа к следующему,
+        # куски между ними (числа, пробелы, содержимое строк) копируются целиком
+        pos, n = 0, len(text)
+        while pos < n and not self._done:  # после закрытия корня — хвостовой мусор
+            buf = self._buf
+            if not self._stack:
+                start = text.find("{", pos)
+                if start == -1:
+                    return
+                self._open("{")
+                pos = start + 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    buf.append(text[pos])
+                    self._escape = False
+                    pos += 1
+                    continue
+                m = _STRING_SPECIAL.search(text, pos)
+                if m is None:
+                    buf.append(text[pos:])
+                    return
+                i = m.start()
+                buf.append(text[pos:i + 1])
+                pos = i + 1
+                if text[i] == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._root_key = "".join(buf[self._string_start:])[1:-1]
+                continue
+
+            m = _STRUCTURAL.search(text, pos)
+            end = m.start() if m else n
+            if end > pos:
+                segment = text[pos:end]
+                buf.append(segment)
+                if not segment.isspace():
+                    self._pending_comma = None
+            if m is None:
+                return
+            pos = end + 1
+            self._structural(text[end], ready)
+            if self._replay is not None:
+                # корень оказался ложным — продолжаем с текста после его '{', без рекурсии:
+                # на тысячах '{' подряд в пояснении стек вызовов бы кончился
+                text = self._replay + text[pos:]
+                pos, n = 0, len(text)
+                self._replay = None
+
+    def finish(self) -> ExtractResult:
+        if not self._done:
+            if self._stack:
+                self.result.errors.append("ответ оборван: корневой JSON-объект не закрыт")
+            elif not self.result.variants:
+                self.result.errors.append(NO_VARIANTS_ERROR if self._skipped_root else "в ответе нет JSON-объекта")
+        return self.result
+
+    def _open(self, ch: str) -> None:
+        if len(self._stack) == 1 and ch == "[":
+            self._array_key = self._root_key
+        self._stack.append(ch)
+        self._opened_at.append(len(self._buf))
+        self._buf.append(ch)
+        if len(self._stack) == 3 and ch == "{":
+            self._variant_start = len(self._buf) - 1
+
+    def _structural(self, ch: str, ready: List[Any]) -> None:
+        buf = self._buf
+        if ch in "}]":
+            if self._pending_comma is not None:
+                buf[self._pending_comma] = ""
+            self._pending_comma = None
+            buf.append(ch)
+            opener = self._stack.pop()
+            self._opened_at.pop()
+            if (opener == "{") != (ch == "}"):
+                # каждая ещё открытая '{' упрётся в эту же скобку — кандидатами в корень их не рассматриваем
+                for i in self._opened_at[1:]:
+                    buf[i] = " "
+                self._fail_root("несогласованные скобки", ready)
+                return
+            depth = len(self._stack)
+            if depth == 2 and ch == "}" and self._array_key == VARIANTS_KEY:
+                self._saw_variants = True
+                self._emit_variant("".join(buf[self._variant_start:]), ready)
+            elif depth == 1 and ch == "]":
+                self._array_key = None
+            elif depth == 0:
+                self._close_root(ready)
+            return
+
+        self._pending_comma = len(buf) if ch == "," else None
+        if ch in "{[":
+            self._open(ch)
+            return
+        if ch == '"':
+            self._string_start = len(buf)
+            self._in_string = True
+        buf.append(ch)
+
+    def _emit_variant(self, raw_text: str, ready: List[Any]) -> None:
+        try:
+            raw = json.loads(raw_text)
+        except json.JSONDecodeError as e:
+            self._reject(str(e))
+            return
+        self._accept(raw, ready)
+
+    def _accept(self, raw: Any, ready: List[Any]) -> None:
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("вариант не является объектом")
+            variant = self.validate(raw)
+        except ValueError as e:
+            self._reject(str(e))
+            return
+        self.result.variants.append(variant)
+        ready.append(variant)
+
+    def _reject(self, reason: str) -> None:
+        index = len(self.result.variants) + len(self.result.errors)
+        self.result.errors.append(f"вариант {index + 1}: {reason}")
+
+    def _close_root(self, ready: List[Any]) -> None:
+        self._done = True
+        if self._saw_variants:
+            # варианты уже разобраны по одному, второй раз весь ответ через json.loads не гоняем
+            self.result.complete = True
+            return
+        try:
+            data = json.loads("".join(self._buf))
+        except json.JSONDecodeError as e:
+            self._done = False
+            self._fail_root(str(e), ready)
+            return
+        if not _has_variants(data):
+            # посторонний объект в пояснении — настоящий JSON может идти дальше
+            self._skipped_root = True
+            self._reset_root()
+            return
+        self.result.data = data
+        self.result.complete = True
+
+    def _fail_root(self, reason: str, ready: List[Any]) -> None:
+        # '{' попалась в пояснении перед JSON — ищем следующий кандидат в уже прочитанном тексте
+        if self._saw_variants:
+            self.result.errors.append(f"корневой объект не разобрался: {reason}")
+            self._done = True
+            return
+        self._replay = "".join(self._buf[1:])
+        self.result.errors.clear()
+        self._reset_root()
+
+
+def _has_variants(data: Any) -> bool:
+    return isinstance(data, dict) and (VARIANTS_KEY in data or "headline" in data)
+
+
+def extract_variants(content: str, validate: Optional[Callable[[Dict[str, Any]], Any]] = None) -> ExtractResult:
+    """
+    Разбирает ответ целиком. Обычный случай — корректный JSON после пояснений / ```json —
+    разбирается raw_decode от первой '{' (хвост после объекта игнорируется); объекты без вариантов
+    перед ним ({} в пояснении) пропускаются. Всё остальное (висячие запятые, битые варианты,
+    обрыв) — через JsonStreamExtractor с того места, где raw_decode споткнулся.
+    Если модель вернула один вариант без обёртки "variants", он и считается ответом.
+    """
+    if not isinstance(content, str):
+        raise ExtractError(f"Ожидалась строка с JSON, но пришло: {type(content)}")
+
+    extractor = JsonStreamExtractor(validate)
+    data = None
+    skipped = False
+    start = content.find("{")
+    while start != -1:
+        try:
+            candidate, end = _DECODER.raw_decode(content, start)
+        except json.JSONDecodeError:
+            break
+        if _has_variants(candidate):
+            data = candidate
+            break
+        skipped = True
+        start = content.find("{", end)
+
+    if data is not None:
+        extractor.result.data = data
+        extractor.result.complete = True
+    elif start != -1:
+        extractor._skipped_root = skipped
+        extractor.feed(content[start:])
+        extractor.finish()
+    else:
+        extractor.result.errors.append(NO_VARIANTS_ERROR if skipped else "в ответе нет JSON-объекта")
+
+    result = extractor.result
+    data = result.data
+    if isinstance(data, dict):
+        raw_variants = data.get(VARIANTS_KEY)
+        if isinstance(raw_variants, list):
+            for raw in raw_variants:
+                extractor._accept(raw, [])
+        elif "headline" in data:
+            extractor._accept(data, [])
+        if not result.variants and not result.errors:
+            result.errors.append(NO_VARIANTS_ERROR)
+    return result
@@ -0,0 +1,143 @@
+"""
+Кэш ответов LLM с адресацией по содержимому запроса.
+
+Ключ — sha256 от канонического JSON (модель + системный промпт + payload + temperature
++ параметры запроса, от которых зависит ответ: режим response_format, extra_body и т.п.),
+поэтому одинаковые запросы (ретраи в UI, повторные прогоны) не ходят в API.
+Два уровня: LRU в памяти и каталог на диске с ограничением по размеру.
+Записи лежат в подкаталоге responses/ — вытеснение трогает только его, а не чужие файлы в cache_dir.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+ENTRIES_DIR = "responses"
+
+
+def cache_key(
+    model: str,
+    system_prompt: str,
+    payload: Dict[str, Any],
+    temperature: float,
+    params: Optional[Dict[str, Any]] = None,
+) -> str:
+    canonical = json.dumps(
+        {"model": model, "system": system_prompt, "payload": payload, "temperature": temperature, "params": params or {}},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    max_memory_items — сколько ответов держать в памяти (LRU);
+    max_disk_bytes — предел размера каталога, при превышении удаляются самые давно читанные файлы.
+    cache_dir=None — только память.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = ".llm_cache",
+        max_memory_items: int = 256,
+        max_disk_bytes: int = 100 * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._disk_bytes = 0
+        if cache_dir:
+            self._entries_dir = os.path.join(cache_dir, ENTRIES_DIR)
+            os.makedirs(self._entries_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._entries_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        """(путь, mtime, размер) записей кэша; файлы, удалённые на ходу (другим процессом), пропускаются."""
+        for root, _, files in os.walk(self._entries_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _remember(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # mtime служит отметкой последнего чтения для вытеснения на диске
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None  # файл только что вытеснен — считаем промахом
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self._remember(key, value)
+        if not self.cache_dir:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path) - old_size
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        # чистим с запасом до 90% лимита, чтобы не сканировать каталог на каждой записи
+        files = sorted(self._disk_files(), key=lambda entry: entry[1])
+        target = self.max_disk_bytes * 0.9
+        with self._lock:
+            for path, _, size in files:
+                if self._disk_bytes <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._disk_bytes -= size
@@ -0,0 +1,238 @@
+"""
+Устойчивость вызовов LLM: повторы с джиттером, circuit breaker и запасной ответ.
+
+ResilientLLMClient оборачивает MistralClient / AsyncMistralClient и повторяет запрос при
+- 429 и 5xx (с учётом Retry-After),
+- сетевых ошибках и таймаутах,
+- ответе, из которого не удалось вытащить ни одного варианта (json_extract.ExtractError).
+Ошибки запроса (4xx и т.п.) не повторяются и не влияют на breaker.
+Если API лежит, breaker размыкается и запросы сразу уходят в запасной путь:
+сначала кэш основного клиента, затем fallback-клиент (например, MockLLMClient);
+варианты fallback-клиента помечаются fallback=True, чтобы заглушку было видно в интерфейсе.
+"""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import inspect
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from http_retry import RETRYABLE_STATUSES, backoff_delay, retry_after_seconds
+from json_extract import ExtractError
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold ошибок подряд) -> open -> (reset_timeout секунд) -> half-open.
+    В half-open пропускается один пробный запрос: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """Запрос завершился ошибкой, которая ничего не говорит о доступности API: счётчики не трогаем, пробу отпускаем."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUSES
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, ExtractError))
+
+
+class ResilientLLMClient:
+    """
+    max_retries — сколько повторов после первой попытки;
+    max_retry_after — потолок ожидания по Retry-After, чтобы один ответ 429 не подвесил запрос надолго;
+    fallback — клиент на случай, когда повторы исчерпаны или breaker разомкнут (None — пробросить ошибку).
+    Работает и с синхронным, и с асинхронным основным клиентом.
+    """
+
+    def __init__(
+        self,
+        primary,
+        fallback=None,
+        max_retries: int = 3,
+        max_retry_after: float = 30.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker()
+
+    def _delay(self, exc: BaseException, attempt: int) -> float:
+        if isinstance(exc, httpx.HTTPStatusError):
+            retry_after = retry_after_seconds(exc.response)
+            if retry_after is not None:
+                return min(retry_after, self.max_retry_after)
+        return backoff_delay(attempt)
+
+    def _should_retry(self, exc: BaseException, attempt: int) -> bool:
+        # повторяем, только пока цепь не разомкнулась от чужих ошибок
+        return attempt < self.max_retries and _is_retryable(exc) and self.breaker.state == "closed"
+
+    def _fallback(self, payload: Dict[str, Any], error: BaseException) -> List[Any]:
+        from_cache = getattr(self.primary, "_from_cache", None)
+        if from_cache is not None:
+            cached = from_cache(payload, True)
+            if cached is not None:
+                return cached
+        if self.fallback is None:
+            raise error
+        return [
+            dataclasses.replace(v, fallback=True) if dataclasses.is_dataclass(v) and hasattr(v, "fallback") else v
+            for v in self.fallback.generate_variants(payload)
+        ]
+
+    def generate_variants(self, payload: Dict[str, Any], use_cache: bool = True):
+        if inspect.iscoroutinefunction(self.primary.generate_variants):
+            return self._agenerate_variants(payload, use_cache)
+
+        if not self.breaker.allow():
+            return self._fallback(payload, CircuitOpenError("Mistral API недоступен, цепь разомкнута"))
+
+        attempt = 0
+        while True:
+            try:
+                variants = self.primary.generate_variants(payload, use_cache=use_cache)
+            except Exception as e:
+                if not _is_retryable(e):
+                    self.breaker.release()  # 4xx — ошибка запроса, а не недоступность API
+                    raise
+                self.breaker.record_failure()
+                if not self._should_retry(e, attempt):
+                    return self._fallback(payload, e)
+                time.sleep(self._delay(e, attempt))
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            return variants
+
+    async def _agenerate_variants(self, payload: Dict[str, Any], use_cache: bool) -> List[Any]:
+        if not self.breaker.allow():
+            return self._fallback(payload, CircuitOpenError("Mistral API недоступен, цепь разомкнута"))
+
+        attempt = 0
+        while True:
+            try:
+                variants = await self.primary.generate_variants(payload, use_cache=use_cache)
+            except Exception as e:
+                if not _is_retryable(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if not self._should_retry(e, attempt):
+                    return self._fallback(payload, e)
+                await asyncio.sleep(self._delay(e, attempt))
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            return variants
+
+    def generate_batch(self, payloads: List[Dict[str, Any]], use_cache: bool = True) -> List[List[Any]]:
+        """
+        Пачка одним запросом через primary.generate_batch. Если его нет, breaker не пропускает
+        или пачка упала с временной ошибкой — по одному через generate_variants (с повторами и запасным ответом).
+        Ответы пачки, которые не разобрались, тоже повторяются через generate_variants, а не голым primary.
+        """
+        batch = getattr(self.primary, "generate_batch", None)
+        if batch is not None and self.breaker.allow():
+            try:
+                results = batch(payloads, use_cache=use_cache, retry_failed=False)
+            except Exception as e:
+                if not _is_retryable(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+                return [
+                    variants if variants is not None else self.generate_variants(p, use_cache=False)
+                    for p, variants in zip(payloads, results)
+                ]
+        return [self.generate_variants(p, use_cache) for p in payloads]
+
+    def stream_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> Iterator[Any]:
+        """
+        Потоковая генерация через primary.stream_variants. Если стрим упал до первого варианта —
+        обычный путь generate_variants с повторами и запасным ответом; если breaker не пропускает — сразу запасной ответ.
+        Ошибка посреди стрима пробрасывается: часть вариантов уже показана пользователю.
+        """
+        stream = getattr(self.primary, "stream_variants", None)
+        if stream is None:
+            yield from self.generate_variants(payload, use_cache)
+            return
+        if not self.breaker.allow():
+            yield from self._fallback(payload, CircuitOpenError("Mistral API недоступен, цепь разомкнута"))
+            return
+
+        yielded = 0
+        try:
+            for variant in stream(payload, use_cache=use_cache):
+                yielded += 1
+                yield variant
+        except GeneratorExit:
+            self.breaker.release()  # потребитель бросил стрим — о доступности API это ничего не говорит
+            raise
+        except Exception as e:
+            if not _is_retryable(e):
+                self.breaker.release()
+                raise
+            self.breaker.record_failure()
+            if yielded:
+                raise
+            yield from self.generate_variants(payload, use_cache)
+            return
+
+        self.breaker.record_success()
@@ -1,22 +1,51 @@
-import json
-from typing import Dict
+from typing import Dict, Sequence, Union
 
-# Загружаем описание персон (структура categorized_personas.json зависит от твоего проекта)
-# Здесь мы просто читаем файл, чтобы он был частью пайплайна —
-# в текущей заглушке evaluate_ad мы его не используем, но он готов.
-try:
-    with open("categorized_personas.json", "r", encoding="utf-8") as f:
-        parsed = json.load(f)
-except FileNotFoundError:
-    parsed = {}  # если файла нет — просто игнорируем, заглушка всё равно работает
+import numpy as np
+
+from ad_rules import RuleEngine
+
+# Описание персон (categorized_personas.json) здесь не читаем: заглушке оно не нужно,
+# а кому нужно — берут его лениво через persona_store.get_store().
+
+# Правила оценщика лежат в ad_rules.json и перечитываются при его изменении
+_rules = RuleEngine()
+
+
+def evaluate_ads(texts: Sequence[str], audiences: Union[str, Sequence[str]]) -> Dict[str, np.ndarray]:
+    """
+    Векторная версия evaluate_ad для пачки текстов.
+    audiences — один сегмент на всю пачку или по сегменту на каждый текст.
+
+    Тексты приводятся к нижнему регистру одним вызовом на всю пачку, поиск основ — подстрокой
+    (быстрее объединённого regex: на каждое совпадение не создаётся match-объект);
+    длины и арифметика скоров — массивы NumPy.
+
+    Возвращает {"click_probability": array(N), "purchase_probability": array(N)}.
+    """
+    return _rules.evaluate(texts, audiences)
+
+
+def evaluate_ad_segments(ad_text: str) -> Dict[str, Dict[str, float]]:
+    """
+    Оценка одного текста сразу для всех сегментов из ad_rules.json за один проход по тексту.
+    Возвращает {сегмент: {"click_probability": ..., "purchase_probability": ...}}.
+    """
+    segments, scores = _rules.evaluate_segments([ad_text])
+    return {
+        segment: {key: float(values[0, i]) for key, values in scores.items()}
+        for i, segment in enumerate(segments)
+    }
 
 
 def evaluate_ad(ad_text: str, target_audience: str) -> Dict[str, float]:
     """
     Простая эвристическая заглушка-оценщик рекламы.
     В реальной системе здесь мог бы быть вызов LLM по промпту,
-    но сейчас мы считаем вероятность клика/покупки по простым правилам,
-    чтобы код работал без внешних API.
+    но сейчас мы считаем вероятность клика/покупки по простым правилам
+    из ad_rules.json, чтобы код работал без внешних API: базовый скор, веса основ,
+    штраф за длину, надбавки для сегментов и сдвиг покупки относительно клика
+    берутся из файла (формат — в докстринге ad_rules), результат обрезается в [0, 1].
+    Для пачек текстов используйте evaluate_ads, для всех сегментов разом — evaluate_ad_segments.
 
     Возвращает:
     {
@@ -24,38 +53,8 @@ def evaluate_ad(ad_text: str, target_audience: str) -> Dict[str, float]:
         "purchase_probability": float от 0 до 1
     }
     """
-    text_lower = ad_text.lower()
-
-    # Базовый старт
-    score = 0.5
-
-    # Эвристики: наличие слов "скидка", "бесплатно", "новинка" и т.п.
-    if "скид" in text_lower:
-        score += 0.2
-    if "бесплат" in text_lower:
-        score += 0.1
-    if "новин" in text_lower:
-        score += 0.05
-
-    # Длина текста: слишком короткий или слишком длинный — хуже
-    length = len(ad_text)
-    if length < 80:
-        score -= 0.1
-    elif length > 600:
-        score -= 0.1
-
-    # Немного учитываем тип аудитории по названию сегмента
-    if "low_income" in target_audience.lower() and "скид" in text_lower:
-        score += 0.05  # для малообеспеченной аудитории скидка важнее
-
-    # Нормируем в [0, 1]
-    click_probability = max(0.0, min(1.0, score))
-    purchase_probability = max(0.0, min(1.0, score - 0.1))
-
-    return {
-        "click_probability": click_probability,
-        "purchase_probability": purchase_probability,
-    }
+    scores = evaluate_ads([ad_text], target_audience)
+    return {key: float(values[0]) for key, values in scores.items()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import threading
+
+# Общий на процесс реестр моделей эмбеддингов.
+# Модуль живёт в sys.modules, поэтому модели переживают и повторные создания
+# ProductAnalyzer, и перезапуски скрипта Streamlit.
+_models = {}
+# RLock: фабрика одной модели может запросить другую (например, int8-версия берёт fp32)
+_lock = threading.RLock()
+
+
+def get_or_create(key, factory):
+    """
+    Возвращает объект по ключу, создавая его через factory() при первом обращении.
+    """
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        if key not in _models:
+            _models[key] = factory()
+        return _models[key]
+
+
+def get_model(name):
+    """
+    Возвращает SentenceTransformer по имени, загружая его при первом обращении.
+    sentence_transformers/torch импортируются только здесь, а не при импорте модулей.
+    """
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(name)
+
+    return get_or_create(name, load)
+
+
+def is_loaded(key):
+    return key in _models
+
+
+def warmup(key, factory=None):
+    """
+    Грузит модель в фоновом потоке. Если кто-то вызовет get_model раньше,
+    чем загрузка закончится, он просто подождёт на том же локе.
+    """
+    if factory is None:
+        thread = threading.Thread(target=get_model, args=(key,), daemon=True)
+    else:
+        thread = threading.Thread(target=get_or_create, args=(key, factory), daemon=True)
+    thread.start()
+    return thread
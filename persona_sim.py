@@ -0,0 +1,324 @@
+"""
+Локальная симуляция реакции персон (categorized_personas.json) на рекламу — без вызова LLM.
+
+Персоны кодируются в матрицу признаков X (персоны × признаки): one-hot возраста, пола,
+соцстатуса и канала, multi-hot интересов и поведения, ценовая чувствительность.
+Объявления — в матрицу сигналов A (объявления × сигналы): скидка, срочность, новизна,
+тематика (по интересам), канал и т.п. по основам слов.
+Вероятности для всех персон и всех объявлений считаются одним шагом:
+    click    = sigmoid(X @ W_click @ A.T)
+    purchase = click * sigmoid(X @ W_buy @ A.T)
+W_click / W_buy собираются из таблиц CLICK_WEIGHTS / PURCHASE_WEIGHTS ниже.
+
+    python persona_sim.py  # пример: два объявления по всем сегментам + A/B
+"""
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ad_rules import stem_hits
+from persona_store import PERSONAS_PATH, PersonaStore, get_store
+
+
+AGE_RANGES = ["13-17", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+GENDERS = ["male", "female", "prefer_not_to_say"]
+SOCIAL = ["low", "lower_middle", "middle", "upper_middle", "high"]
+PREFERRED_CHANNELS = [
+    "messenger_tg_whatsapp_wechat", "social_instagram_tiktok_vk_fb", "search_google_yandex",
+    "video_youtube_streaming", "apps_push", "influencer_content", "email", "retail_ooh",
+]
+INTERESTS = [
+    "tech_gadgets", "gaming", "health_fitness", "sports", "home_family", "diy_hobbies",
+    "eco_sustainability", "entertainment", "fashion_beauty", "automotive", "finance_investing",
+    "art_culture", "education_self_development", "food_cooking", "travel_experiences",
+]
+BEHAVIORS = [
+    "reacts_to_discounts", "impulsive_buyer", "trend_follower", "early_adopter", "late_adopter",
+    "social_proof_reactive", "quality_seeker", "brand_loyal", "researcher", "utilitarian_buyer",
+    "high_engagement", "passive_scroller", "ad_blocking", "privacy_conscious",
+]
+
+# Каналы генерации (prompt.AdGenerator) -> предпочитаемый канал персоны
+AD_CHANNELS = {
+    "telegram": "messenger_tg_whatsapp_wechat",
+    "vk": "social_instagram_tiktok_vk_fb",
+    "yandex_ads": "search_google_yandex",
+}
+
+# Сигналы объявления: основа (без учёта регистра) -> сигнал. Основа ищется с начала слова
+# (ad_rules.stem_hits с words=True), «$» на конце — слово целиком: «хит$» не срабатывает на «хитрый»
+SIGNAL_STEMS = {
+    "discount": ["скид", "%", "акци", "распродаж", "выгод", "дешевл"],
+    "free": ["бесплат", "в подарок"],
+    "novelty": ["новин", "новый", "новая", "впервые"],
+    "urgency": ["успей", "успеть", "успеете", "только сегодня", "осталось", "последн", "ограничен"],
+    "social_proof": ["отзыв", "выбирают", "популяр", "хит$", "хиты$", "бестселлер", "рейтинг"],
+    "quality": ["премиум", "качеств", "гаранти", "надёжн", "надежн", "оригинал"],
+    "specs": ["гц$", "мп$", "ггц$", "мач$", "гб$", "процессор", "амолед", "amoled"],
+}
+TOPIC_STEMS = {
+    "tech_gadgets": ["смартфон", "ноутбук", "гаджет", "наушник", "планшет", "смарт", "техник", "телефон"],
+    "gaming": ["игр", "гейм", "консол"],
+    "health_fitness": ["фитнес", "здоров", "пульс"],
+    "sports": ["спорт", "бег", "трениров"],
+    "home_family": ["для дома", "семь", "детск"],
+    "diy_hobbies": ["своими руками", "инструмент", "ремонт", "хобби"],
+    "eco_sustainability": ["эколог", "эко-", "переработ"],
+    "entertainment": ["фильм", "сериал", "музык", "развлеч"],
+    "fashion_beauty": ["стил", "модн", "красот", "дизайн"],
+    "automotive": ["автомоб", "авто$", "машин"],
+    "finance_investing": ["рассрочк", "кэшбэк", "кешбэк", "инвест"],
+    "art_culture": ["искусств", "культур", "творч"],
+    "education_self_development": ["обучен", "курс", "учёб", "учеб"],
+    "food_cooking": ["кухн", "готовк", "рецепт"],
+    "travel_experiences": ["путешеств", "поездк", "отпуск", "в дорог"],
+}
+_EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF☀-➿]")
+
+PERSONA_FEATURES = (
+    ["bias"]
+    + [f"age:{v}" for v in AGE_RANGES]
+    + [f"gender:{v}" for v in GENDERS]
+    + [f"social:{v}" for v in SOCIAL]
+    + [f"channel:{v}" for v in PREFERRED_CHANNELS]
+    + [f"interest:{v}" for v in INTERESTS]
+    + [f"behavior:{v}" for v in BEHAVIORS]
+    + ["price_sensitivity"]
+)
+AD_SIGNALS = (
+    ["bias", "emoji", "length_off"]
+    + list(SIGNAL_STEMS)
+    + [f"topic:{v}" for v in INTERESTS]
+    + [f"channel:{v}" for v in PREFERRED_CHANNELS]
+)
+
+# (признак персоны, сигнал объявления) -> вклад в логит клика
+CLICK_WEIGHTS = {
+    ("bias", "bias"): -2.2,
+    ("bias", "length_off"): -0.3,
+    ("price_sensitivity", "discount"): 1.0,
+    ("price_sensitivity", "free"): 0.5,
+    ("price_sensitivity", "quality"): -0.3,
+    ("behavior:reacts_to_discounts", "discount"): 0.8,
+    ("behavior:reacts_to_discounts", "free"): 0.4,
+    ("behavior:impulsive_buyer", "urgency"): 0.6,
+    ("behavior:impulsive_buyer", "discount"): 0.3,
+    ("behavior:impulsive_buyer", "emoji"): 0.2,
+    ("behavior:trend_follower", "novelty"): 0.6,
+    ("behavior:trend_follower", "social_proof"): 0.3,
+    ("behavior:early_adopter", "novelty"): 0.7,
+    ("behavior:early_adopter", "specs"): 0.2,
+    ("behavior:late_adopter", "novelty"): -0.4,
+    ("behavior:late_adopter", "social_proof"): 0.3,
+    ("behavior:social_proof_reactive", "social_proof"): 0.8,
+    ("behavior:quality_seeker", "quality"): 0.6,
+    ("behavior:quality_seeker", "discount"): -0.2,
+    ("behavior:brand_loyal", "quality"): 0.3,
+    ("behavior:researcher", "specs"): 0.5,
+    ("behavior:researcher", "urgency"): -0.3,
+    ("behavior:utilitarian_buyer", "specs"): 0.3,
+    ("behavior:utilitarian_buyer", "emoji"): -0.2,
+    ("behavior:high_engagement", "bias"): 0.3,
+    ("behavior:passive_scroller", "bias"): -0.3,
+    ("behavior:ad_blocking", "bias"): -1.0,
+    ("behavior:privacy_conscious", "bias"): -0.2,
+    ("social:low", "discount"): 0.2,
+    ("social:lower_middle", "discount"): 0.1,
+    ("social:high", "quality"): 0.3,
+    ("social:high", "discount"): -0.2,
+    ("age:13-17", "emoji"): 0.3,
+    ("age:18-24", "emoji"): 0.2,
+    ("age:55-64", "emoji"): -0.2,
+    ("age:65+", "emoji"): -0.3,
+}
+CLICK_WEIGHTS.update({(f"interest:{v}", f"topic:{v}"): 0.6 for v in INTERESTS})
+CLICK_WEIGHTS.update({(f"channel:{v}", f"channel:{v}"): 0.5 for v in PREFERRED_CHANNELS})
+
+# (признак персоны, сигнал объявления) -> вклад в логит покупки после клика
+PURCHASE_WEIGHTS = {
+    ("bias", "bias"): -1.0,
+    ("price_sensitivity", "bias"): -1.0,
+    ("price_sensitivity", "discount"): 0.8,
+    ("social:low", "bias"): -0.3,
+    ("social:upper_middle", "bias"): 0.2,
+    ("social:high", "bias"): 0.4,
+    ("behavior:impulsive_buyer", "bias"): 0.5,
+    ("behavior:impulsive_buyer", "urgency"): 0.3,
+    ("behavior:researcher", "bias"): -0.2,
+    ("behavior:researcher", "specs"): 0.3,
+    ("behavior:brand_loyal", "bias"): 0.2,
+}
+PURCHASE_WEIGHTS.update({(f"interest:{v}", f"topic:{v}"): 0.4 for v in INTERESTS})
+
+
+def _weight_matrix(weights: Dict[Tuple[str, str], float]) -> np.ndarray:
+    persona_index = {name: i for i, name in enumerate(PERSONA_FEATURES)}
+    signal_index = {name: i for i, name in enumerate(AD_SIGNALS)}
+    matrix = np.zeros((len(PERSONA_FEATURES), len(AD_SIGNALS)), dtype=np.float32)
+    for (feature, signal), weight in weights.items():
+        matrix[persona_index[feature], signal_index[signal]] = weight
+    return matrix
+
+
+def encode_personas(store: PersonaStore) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Колонки PersonaStore -> (X (персоны, признаки) float32, номер сегмента каждой персоны, сегменты).
+    Коды каждой колонки переводятся в столбцы X через словарь колонки, без цикла по персонам.
+    Неизвестные значения признаков просто не попадают в one-hot.
+    """
+    index = {name: i for i, name in enumerate(PERSONA_FEATURES)}
+    n = len(store)
+    X = np.zeros((n, len(PERSONA_FEATURES)), dtype=np.float32)
+    X[:, index["bias"]] = 1.0
+
+    def lookup(column: str, prefix: str) -> np.ndarray:
+        return np.array([index.get(f"{prefix}:{v}", -1) for v in store.values(column)], dtype=np.int64)
+
+    for column, prefix in (("age_range", "age"), ("gender", "gender"), ("social", "social"), ("preferred_channel", "channel")):
+        cols = lookup(column, prefix)[store.codes(column)]
+        known = cols >= 0
+        X[np.flatnonzero(known), cols[known]] = 1.0
+    for column, prefix in (("interests", "interest"), ("behaviors", "behavior")):
+        cols = lookup(column, prefix)[store.codes(column)]
+        rows = np.repeat(np.arange(n), np.diff(store.columns[f"{column}_offsets"]))
+        known = cols >= 0
+        X[rows[known], cols[known]] = 1.0
+    X[:, index["price_sensitivity"]] = store.price_sensitivity
+    return X, store.codes("segment").astype(np.int32), list(store.segments)
+
+
+def encode_ads(texts: Sequence[str], channels: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Тексты (и каналы генерации: telegram / vk / yandex_ads) -> A (объявления, сигналы) float32.
+    Поиск основ — ad_rules.stem_hits(words=True): lower() один вызов на всю пачку, основы — с начала слова.
+    """
+    n = len(texts)
+    index = {name: i for i, name in enumerate(AD_SIGNALS)}
+    A = np.zeros((n, len(AD_SIGNALS)), dtype=np.float32)
+    A[:, index["bias"]] = 1.0
+
+    groups = list(SIGNAL_STEMS.items()) + [(f"topic:{k}", v) for k, v in TOPIC_STEMS.items()]
+    all_stems = sorted({s for _, stems in groups for s in stems})
+    column = {s: i for i, s in enumerate(all_stems)}
+    hits = stem_hits(texts, all_stems, words=True)
+    for name, stems in groups:
+        A[:, index[name]] = hits[:, [column[s] for s in stems]].any(axis=1)
+
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n)
+    A[:, index["length_off"]] = (lengths < 80) | (lengths > 600)
+    A[:, index["emoji"]] = np.fromiter((_EMOJI_RE.search(t) is not None for t in texts), dtype=bool, count=n)
+
+    if channels is not None:
+        for row, channel in enumerate(channels):
+            col = index.get(f"channel:{AD_CHANNELS.get(channel, channel)}")
+            if col is not None:
+                A[row, col] = 1.0
+    return A
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class SimulationResult:
+    """
+    click, purchase — (персоны, объявления); segment_ids — номер сегмента каждой персоны.
+    """
+
+    def __init__(self, click: np.ndarray, purchase: np.ndarray, segment_ids: np.ndarray, segments: List[str]):
+        self.click = click
+        self.purchase = purchase
+        self.segment_ids = segment_ids
+        self.segments = segments
+
+    def _rows(self, segment: Optional[str]) -> np.ndarray:
+        if segment is None:
+            return np.arange(len(self.segment_ids))
+        return np.flatnonzero(self.segment_ids == self.segments.index(segment))
+
+    def segment_summary(self, z: float = 1.96) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        По каждому сегменту и объявлению: mean — ожидаемая доля кликнувших (купивших) персон сегмента
+        и интервал low..high для этой доли в одном прогоне (по умолчанию 95%): каждая персона
+        кликает независимо со своей вероятностью p_i, так что доля — сумма Бернулли с дисперсией
+        Σ p_i(1 − p_i) / n², интервал — нормальное приближение mean ± z·√дисперсии, обрезанное в [0, 1].
+        Разброс самих p_i между персонами сюда не входит: вероятности детерминированы.
+        Все сегменты считаются разом через np.add.at.
+        Возвращает {"click_probability" | "purchase_probability": {"mean", "low", "high": (сегменты, объявления)},
+                    "n": (сегменты,)}.
+        """
+        n = np.bincount(self.segment_ids, minlength=len(self.segments)).astype(np.float64)
+        summary: Dict[str, Dict[str, np.ndarray]] = {"n": n}
+        for key, values in (("click_probability", self.click), ("purchase_probability", self.purchase)):
+            p = values.astype(np.float64)
+            sums = np.zeros((len(self.segments), values.shape[1]))
+            bernoulli_var = np.zeros_like(sums)
+            np.add.at(sums, self.segment_ids, p)
+            np.add.at(bernoulli_var, self.segment_ids, p * (1.0 - p))
+            count = np.maximum(n, 1)[:, None]
+            mean = sums / count
+            half = z * np.sqrt(bernoulli_var) / count
+            summary[key] = {"mean": mean, "low": np.clip(mean - half, 0.0, 1.0), "high": np.clip(mean + half, 0.0, 1.0)}
+        return summary
+
+    def ab_test(self, a: int, b: int, segment: Optional[str] = None, metric: str = "click_probability") -> Dict[str, float]:
+        """
+        Парное сравнение объявлений a и b на одних и тех же персонах (сегмента или всех):
+        средняя разница, 95% интервал и двусторонний p-value (нормальное приближение).
+        """
+        values = self.click if metric == "click_probability" else self.purchase
+        diff = (values[:, a] - values[:, b])[self._rows(segment)].astype(np.float64)
+        n = len(diff)
+        mean = float(diff.mean()) if n else 0.0
+        se = float(diff.std(ddof=1) / math.sqrt(n)) if n > 1 else 0.0
+        z = mean / se if se > 0 else 0.0
+        return {
+            "diff": mean,
+            "low": mean - 1.96 * se,
+            "high": mean + 1.96 * se,
+            "p_value": math.erfc(abs(z) / math.sqrt(2.0)) if se > 0 else 1.0,
+            "n": n,
+        }
+
+
+class PersonaSimulator:
+    def __init__(self, store: PersonaStore):
+        self.features, self.segment_ids, self.segments = encode_personas(store)
+        # X @ W от объявлений не зависит — считаем один раз, на пачку остаётся одно умножение (персоны × сигналы) @ (сигналы × объявления)
+        self._click_proj = self.features @ _weight_matrix(CLICK_WEIGHTS)
+        self._buy_proj = self.features @ _weight_matrix(PURCHASE_WEIGHTS)
+
+    @classmethod
+    def from_json(cls, path: str = PERSONAS_PATH) -> "PersonaSimulator":
+        return cls(get_store(path))
+
+    def simulate(self, texts: Sequence[str], channels: Optional[Sequence[str]] = None) -> SimulationResult:
+        A = encode_ads(texts, channels)
+        click = _sigmoid(self._click_proj @ A.T)
+        purchase = click * _sigmoid(self._buy_proj @ A.T)
+        return SimulationResult(click, purchase, self.segment_ids, self.segments)
+
+
+if __name__ == "__main__":
+    ads = [
+        """iPhone 17 — твой следующий уровень технологий!
+Ощути невероятную скорость, улучшенную камеру и долгий срок работы батареи.
+💥 Скидка 10% только сегодня!""",
+        """iPhone 17. Процессор нового поколения, камера 48 Мп, до 30 часов работы.
+Официальная гарантия и бесплатная доставка. Купить онлайн.""",
+    ]
+    sim = PersonaSimulator.from_json()
+    result = sim.simulate(ads, channels=["telegram", "yandex_ads"])
+    summary = result.segment_summary()
+
+    print(f"{'СЕГМЕНТ':<40} | {'N':>4} | {'КЛИК A (95% ДИ)':<22} | {'КЛИК B (95% ДИ)':<22}")
+    print("-" * 96)
+    click = summary["click_probability"]
+    for s, segment in enumerate(result.segments):
+        cells = [f"{click['mean'][s, j]:.3f} [{click['low'][s, j]:.3f}, {click['high'][s, j]:.3f}]" for j in range(2)]
+        print(f"{segment:<40} | {int(summary['n'][s]):>4} | {cells[0]:<22} | {cells[1]:<22}")
+
+    ab = result.ab_test(0, 1)
+    print(f"\nA − B по всем персонам: {ab['diff']:+.4f} [{ab['low']:+.4f}, {ab['high']:+.4f}], p = {ab['p_value']:.3g}")
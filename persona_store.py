@@ -0,0 +1,241 @@
+"""
+Общее хранилище персон из categorized_personas.json.
+
+Файл читается один раз на процесс и только при первом обращении (get_store()),
+разобранные колонки кэшируются в .persona_cache/personas-<хэш пути>.pkl — при следующих запусках
+JSON не парсится, пока у него не поменялись mtime или размер. У каждого файла персон свой кэш,
+путь источника хранится в кэше и сверяется при загрузке.
+
+Колонки (по строке на персону, порядок — как в файле):
+- ids, segment / age_range / gender / social / preferred_channel — коды в словари *_values;
+- price_sensitivity — float64;
+- interests / behaviors — CSR: коды подряд + смещения (порядок внутри персоны сохраняется).
+Инвертированные индексы: сегмент, интерес, поведение, канал -> номера строк.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+PERSONAS_PATH = "categorized_personas.json"
+CACHE_DIR = ".persona_cache"
+
+_ENUM_COLUMNS = ["segment", "age_range", "gender", "social", "preferred_channel"]
+_LIST_COLUMNS = ["interests", "behaviors"]
+
+
+def _encode(values: Iterable[str], vocab: Dict[str, int]) -> np.ndarray:
+    return np.array([vocab.setdefault(v, len(vocab)) for v in values], dtype=np.int32)
+
+
+def _build_columns(parsed: Dict[str, List[Dict]]) -> Dict[str, np.ndarray]:
+    rows = [(segment, p) for segment, people in parsed.items() for p in people]
+    columns: Dict[str, np.ndarray] = {"ids": np.array([p.get("id", "") for _, p in rows], dtype=str)}
+
+    for name in _ENUM_COLUMNS:
+        vocab: Dict[str, int] = {}
+        get = (lambda r: r[0]) if name == "segment" else (lambda r, n=name: r[1].get(n, ""))
+        columns[name] = _encode((get(r) for r in rows), vocab)
+        columns[f"{name}_values"] = np.array(list(vocab), dtype=str)
+
+    for name in _LIST_COLUMNS:
+        vocab = {}
+        lists = [p.get(name, []) for _, p in rows]
+        columns[name] = _encode((v for values in lists for v in values), vocab)
+        columns[f"{name}_offsets"] = np.cumsum([0] + [len(values) for values in lists], dtype=np.int64)
+        columns[f"{name}_values"] = np.array(list(vocab), dtype=str)
+
+    columns["price_sensitivity"] = np.array([p.get("price_sensitivity", 0.5) for _, p in rows], dtype=np.float64)
+    return columns
+
+
+class PersonaStore:
+    def __init__(self, path: str = PERSONAS_PATH, cache_dir: Optional[str] = CACHE_DIR):
+        self.path = path
+        stat = os.stat(path)
+        self.source_key = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        self._source_path = os.path.abspath(path)
+
+        cache_path = None
+        if cache_dir:
+            # два разных файла с совпавшими mtime и размером не должны делить один кэш
+            path_hash = hashlib.sha1(self._source_path.encode("utf-8")).hexdigest()[:16]
+            cache_path = os.path.join(cache_dir, f"personas-{path_hash}.pkl")
+        columns = self._load_cache(cache_path)
+        if columns is None:
+            with open(path, "r", encoding="utf-8") as f:
+                columns = _build_columns(json.load(f))
+            if cache_path:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(
+                        {"source_path": self._source_path, "source_key": self.source_key.tolist(), "columns": columns},
+                        f,
+                        pickle.HIGHEST_PROTOCOL,
+                    )
+                os.replace(tmp_path, cache_path)
+
+        self.columns = columns
+        self.ids = columns["ids"]
+        self.price_sensitivity = columns["price_sensitivity"]
+        self.segments: List[str] = columns["segment_values"].tolist()
+        self._records: Optional[List[Dict]] = None
+        self._index: Dict[str, Dict[str, np.ndarray]] = {}
+        self._by_id: Optional[Dict[str, int]] = None
+
+    def _load_cache(self, cache_path: Optional[str]) -> Optional[Dict[str, np.ndarray]]:
+        if not cache_path or not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, "rb") as f:
+                data = pickle.load(f)
+            if data["source_path"] != self._source_path or data["source_key"] != self.source_key.tolist():
+                return None
+            return data["columns"]
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            return None  # битый кэш — просто пересобираем из JSON
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # --- колонки ---
+
+    def codes(self, name: str) -> np.ndarray:
+        """Коды колонки-перечисления (segment, age_range, gender, social, preferred_channel)."""
+        return self.columns[name]
+
+    def values(self, name: str) -> List[str]:
+        """Словарь колонки: values(name)[code] -> исходное значение."""
+        return self.columns[f"{name}_values"].tolist()
+
+    def multi_hot(self, name: str) -> np.ndarray:
+        """(персоны, словарь) bool для interests / behaviors."""
+        codes, offsets = self.columns[name], self.columns[f"{name}_offsets"]
+        matrix = np.zeros((len(self), len(self.values(name))), dtype=bool)
+        matrix[np.repeat(np.arange(len(self)), np.diff(offsets)), codes] = True
+        return matrix
+
+    # --- инвертированные индексы ---
+
+    def index(self, name: str) -> Dict[str, np.ndarray]:
+        """
+        {значение: номера строк по возрастанию} для segment, age_range, gender, social,
+        preferred_channel, interests, behaviors. Строится при первом обращении.
+        """
+        if name not in self._index:
+            codes = self.columns[name]
+            if name in _LIST_COLUMNS:
+                rows = np.repeat(np.arange(len(self)), np.diff(self.columns[f"{name}_offsets"]))
+            else:
+                rows = np.arange(len(self))
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(self.values(name)) + 1))
+            self._index[name] = {
+                value: rows[order[bounds[i]:bounds[i + 1]]] for i, value in enumerate(self.values(name))
+            }
+        return self._index[name]
+
+    def filter(
+        self,
+        segment: Optional[str] = None,
+        interests: Iterable[str] = (),
+        behaviors: Iterable[str] = (),
+        preferred_channel: Optional[str] = None,
+    ) -> np.ndarray:
+        """
+        Номера строк персон, подходящих под все условия сразу (пересечение индексов).
+        Неизвестное значение даёт пустой результат.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        selections = []
+        if segment is not None:
+            selections.append(self.index("segment").get(segment, empty))
+        if preferred_channel is not None:
+            selections.append(self.index("preferred_channel").get(preferred_channel, empty))
+        selections += [self.index("interests").get(v, empty) for v in interests]
+        selections += [self.index("behaviors").get(v, empty) for v in behaviors]
+
+        if not selections:
+            return np.arange(len(self))
+        result = selections[0]
+        for rows in selections[1:]:
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+    # --- записи в исходном виде ---
+
+    def row_of(self, persona_id: str) -> int:
+        if self._by_id is None:
+            self._by_id = {pid: i for i, pid in enumerate(self.ids.tolist())}
+        return self._by_id[persona_id]
+
+    @property
+    def records(self) -> List[Dict]:
+        """Персоны в виде словарей, как в JSON (без поля сегмента); собираются один раз."""
+        if self._records is None:
+            def decoded(name):
+                vocab = self.values(name)
+                return [vocab[c] for c in self.columns[name].tolist()]
+
+            def split(name):
+                flat, offsets = decoded(name), self.columns[f"{name}_offsets"].tolist()
+                return [flat[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+            self._records = [
+                {
+                    "id": pid,
+                    "age_range": age,
+                    "gender": gender,
+                    "social": social,
+                    "interests": interests,
+                    "behaviors": behaviors,
+                    "preferred_channel": channel,
+                    "price_sensitivity": price,
+                }
+                for pid, age, gender, social, interests, behaviors, channel, price in zip(
+                    self.ids.tolist(),
+                    decoded("age_range"),
+                    decoded("gender"),
+                    decoded("social"),
+                    split("interests"),
+                    split("behaviors"),
+                    decoded("preferred_channel"),
+                    self.price_sensitivity.tolist(),
+                )
+            ]
+        return self._records
+
+    def to_dicts(self, rows: Iterable[int]) -> List[Dict]:
+        records = self.records
+        return [records[i] for i in rows]
+
+    def segment(self, name: str) -> List[Dict]:
+        """Персоны сегмента, как parsed[name] раньше; KeyError для неизвестного сегмента."""
+        if name not in self.index("segment"):
+            raise KeyError(name)
+        return self.to_dicts(self.index("segment")[name])
+
+    def as_segments(self) -> Dict[str, List[Dict]]:
+        return {name: self.segment(name) for name in self.segments}
+
+
+_stores: Dict[str, PersonaStore] = {}
+_lock = threading.Lock()
+
+
+def get_store(path: str = PERSONAS_PATH) -> PersonaStore:
+    """
+    Хранилище на процесс; если JSON на диске изменился, пересобирается при следующем вызове.
+    """
+    stat = os.stat(path)
+    with _lock:
+        store = _stores.get(path)
+        if store is None or store.source_key.tolist() != [stat.st_mtime_ns, stat.st_size]:
+            store = PersonaStore(path)
+            _stores[path] = store
+        return store
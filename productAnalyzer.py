@@ -1,124 +1,318 @@
 import json
 import asyncio
+import multiprocessing
 import httpx
 import math
 import time
 import os
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
 
+from catalog_reader import iter_chunks, iter_products
+from embedding_backends import get_backend
+from embedding_store import AnchorBank, EmbeddingStore
+from ranking import Ranking, ScoreExport
+from trend_cache import TrendCache
+from wordstat_client import WordstatClient
 
-class ProductAnalyzer:
-    def __init__(self, JSON_FILE):
-        self.model = SentenceTransformer('intfloat/multilingual-e5-base')
+MODEL_NAME = 'intfloat/multilingual-e5-base'
+TOP_K = 3
+
+# Оси скоринга: имя -> (позитивный якорь, негативный якорь).
+# Новая ось не добавляет стоимости на товар — это ещё две строки в матрице якорей.
+SCORING_AXES = {
+    "visual": ("яркий красочный насыщенный неоновый броский дизайн визуально привлекательный",
+               "тусклый серый блеклый простой стандартный обычный скучный матовый"),
+    "novelty": ("новинка новый релиз последняя модель 2024 современный инновация тренд",
+                "старый антиквариат устаревший ретро винтаж прошлый век история"),
+    "hype": ("бестселлер хит продаж топ популярный выбор покупателей высокий рейтинг",
+             "средний неизвестный нишевый базовый запасная часть обыденный"),
+}
+
+
+_worker = {}
+
+
+def _init_worker(num_threads, backend, anchor_bank, top_k, category_top_k, batch_size):
+    import torch
+    # воркеры делят ядра между собой, иначе каждый запустит по cpu_count потоков
+    torch.set_num_threads(num_threads)
+    # при fork модель загружена родителем и делится с ним copy-on-write — load() просто вернёт её;
+    # при spawn (нет fork) воркер грузит свою копию здесь
+    backend.load()
+    _worker.update(backend=backend, anchor_bank=anchor_bank, top_k=top_k,
+                   category_top_k=category_top_k, batch_size=batch_size)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _encode_sorted(backend, texts, batch_size):
+    # сортируем по длине, чтобы в батч попадали строки похожей длины и было меньше паддинга
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    chunks = [backend.encode([texts[i] for i in order[start:start + batch_size]], batch_size=batch_size)
+              for start in range(0, len(order), batch_size)]
+
+    sorted_emb = np.concatenate(chunks).astype(np.float32, copy=False)
+    embeddings = np.empty_like(sorted_emb)
+    embeddings[order] = sorted_emb
+    return embeddings
+
+
+def _axis_scores(anchor_bank, embeddings):
+    # (N, число осей): по каждой оси (cos(pos) - cos(neg)) * 100 + 5, не ниже нуля
+    return np.maximum(anchor_bank.scores(embeddings) * 100 + 5, 0)
+
+
+def _score_products(products, trends, axis_scores):
+    m_scores = axis_scores.mean(axis=1)
+
+    processed = []
+
+    for i, p in enumerate(products):
+        total_trend = trends[i]
+
+        m_score = float(m_scores[i])
+        
+        margin = 0
+        price, cost = p.get('price'), p.get('market_cost')
+        # без цены или себестоимости (пустая ячейка CSV, нет поля в JSON) маржу не считаем
+        if _is_number(price) and _is_number(cost) and price > 0:
+            margin = ((price - cost) / price) * 100
+
+        trend_score = math.log1p(total_trend) * 2.5 
+        final = (m_score * 1.5) + (margin * 0.4) + trend_score
         
-        self.visual_pos = self.model.encode(["query: яркий красочный насыщенный неоновый броский дизайн визуально привлекательный"], convert_to_tensor=True)
+        processed.append({
+            **p, 
+            "_temp_trend": total_trend, 
+            "_temp_margin": margin, 
+            "_temp_final": final,
+            "_temp_axes": axis_scores[i].tolist()
+        })
+
+    return processed
+
+
+def _score_shard(job):
+    """
+    Шард чанка в воркере: докодирует промахи кэша эмбеддингов, скорит товары и собирает свой топ-K.
+    Возвращает (Ranking шарда, эмбеддинги промахов для кэша, строки экспорта или None) —
+    в родителя уходят кучи, а не весь шард.
+    """
+    products, passages, trends, found, cached, missing, with_rows = job
+    encoded = None
+    if missing:
+        encoded = _encode_sorted(_worker["backend"], [passages[i] for i in missing],
+                                 max(1, min(_worker["batch_size"], len(missing))))
+
+    dim = (cached if cached is not None else encoded).shape[1]
+    embeddings = np.empty((len(passages), dim), dtype=np.float32)
+    if cached is not None:
+        embeddings[found] = cached
+    if encoded is not None:
+        embeddings[missing] = encoded
+
+    processed = _score_products(products, trends, _axis_scores(_worker["anchor_bank"], embeddings))
+    ranking = Ranking(_worker["top_k"], _worker["category_top_k"])
+    for item in processed:
+        ranking.push(item['_temp_final'], item)
+    rows = [ScoreExport.row(item) for item in processed] if with_rows else None
+    return ranking, encoded, rows
 
-        self.visual_neg = self.model.encode(["query: тусклый серый блеклый простой стандартный обычный скучный матовый"], convert_to_tensor=True)
 
-        self.novelty_pos = self.model.encode(["query: новинка новый релиз последняя модель 2024 современный инновация тренд"], convert_to_tensor=True)
+class ProductAnalyzer:
+    def __init__(self, JSON_FILE, batch_size=64, cache_dir=".embedding_cache", axes=None, wordstat=None,
+                 chunk_size=1024, top_k=TOP_K, category_top_k=None, export_path=None, workers=1,
+                 backend="fp32"):
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
+        # category_top_k: int или {категория: k}; export_path: полный рейтинг в .npz
+        self.top_k = top_k
+        self.category_top_k = category_top_k
+        self.export_path = export_path
 
-        self.novelty_neg = self.model.encode(["query: старый антиквариат устаревший ретро винтаж прошлый век история"], convert_to_tensor=True)
+        # workers > 1: чанк делится на шарды, каждый скорит процесс пула (см. _start_pool)
+        self.workers = workers
+        self._pool = None
 
-        self.hype_pos = self.model.encode(["query: бестселлер хит продаж топ популярный выбор покупателей высокий рейтинг"], convert_to_tensor=True)
+        # backend: "fp32" | "torch-int8" | "onnx" | "onnx-int8" или готовый объект из embedding_backends
+        self.backend = get_backend(backend, MODEL_NAME) if isinstance(backend, str) else backend
 
-        self.hype_neg = self.model.encode(["query: средний неизвестный нишевый базовый запасная часть обыденный"], convert_to_tensor=True)
+        # cache_dir=None — без дисковых кэшей: эмбеддинги и тренды каждый раз считаются заново
+        self.store = EmbeddingStore(cache_dir, self.backend.fingerprint) if cache_dir else None
+
+        # якоря обычно берутся из кэша, тогда модель при создании анализатора не грузится вовсе
+        self.anchor_bank = AnchorBank(axes or SCORING_AXES, self.backend.fingerprint, self.backend.encode, cache_dir)
 
         self.OAUTH_TOKEN = os.getenv("OAUTH_TOKEN")
 
+        if wordstat is None:
+            trend_cache = TrendCache(os.path.join(cache_dir, "trends.sqlite")) if cache_dir else None
+            wordstat = WordstatClient(self.OAUTH_TOKEN, cache=trend_cache)
+        self.wordstat = wordstat
+
         self.JSON_FILE = JSON_FILE 
 
-    def _get_score(self, embedding, pos, neg):
-        score = (util.cos_sim(embedding, pos).item() - util.cos_sim(embedding, neg).item()) * 100
-        return max(0, score + 5)
+    def _encode_passages(self, texts):
+        if not texts:
+            return np.empty((0, self.anchor_bank.matrix.shape[1]), dtype=np.float32)
+        return _encode_sorted(self.backend, texts, self.batch_size)
 
-    async def get_trend_info(self, phrase_name):
-        url = "https://api.wordstat.yandex.net/v1/topRequests"
-
-        payload = {
-            "phrase": phrase_name,
-            "devices": ["phone", "desktop"]
-        }
-
-        headers = {
-            "Content-Type": "application/json; charset=utf-8",
-            "Authorization": f"Bearer {self.OAUTH_TOKEN}"
-        }
-
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                print(f"http ошибка для '{phrase_name}': {e}")
-                return None
-            except Exception as e:
-                print(f"Ошибка соединения для '{phrase_name}': {e}")
-                return None
+    def _embed_passages(self, texts):
+        if self.store is None:
+            return self._encode_passages(texts)
+        return self.store.get_or_encode(texts, self._encode_passages)
 
-    async def run(self):
+    def _get_scores(self, embeddings):
+        return _axis_scores(self.anchor_bank, embeddings)
+
+    def _start_pool(self):
+        """
+        workers > 1: каждый воркер скорит свой шард чанка (промахи кэша эмбеддингов, скоры, свой топ-K),
+        родитель только сливает кучи. Где есть fork, модель грузится здесь, в родителе, и воркеры
+        делят её веса copy-on-write — одна копия на все процессы.
+        Пул создаётся в начале run(), пока нет потоков asyncio.to_thread и соединений httpx;
+        sqlite кэша трендов на время fork закрывается и переоткрывается при следующем запросе.
+        Без fork (Windows) — spawn, и модель грузит каждый воркер.
+        """
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        if method == "fork":
+            self.backend.load()  # синхронно: к fork в процессе не должно быть лишних потоков
+        trend_cache = getattr(self.wordstat, "cache", None)
+        if trend_cache is not None:
+            trend_cache.close()
+
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = multiprocessing.get_context(method).Pool(
+            self.workers, initializer=_init_worker,
+            initargs=(threads, self.backend, self.anchor_bank, self.top_k, self.category_top_k, self.batch_size),
+        )
+
+    async def get_trend_info(self, phrase_name):
         try:
-            with open(self.JSON_FILE, 'r', encoding='utf-8') as f:
-                products = json.load(f)
-        except FileNotFoundError:
-            print(f"Файл {self.JSON_FILE} не найден.")
-            return
+            return await self.wordstat.top_requests(phrase_name)
+        except httpx.HTTPStatusError as e:
+            print(f"http ошибка для '{phrase_name}': {e}")
+            return None
+        except Exception as e:
+            print(f"Ошибка соединения для '{phrase_name}': {e}")
+            return None
 
+    async def _trend_totals(self, products):
         tasks = [self.get_trend_info(p['name']) for p in products]
         api_responses = await asyncio.gather(*tasks)
 
-        processed = []
-        
-        print(f"\n{'ТОВАР':<25} | {'СПРОС (Сумма)':<13} | {'СЧЕТ'}")
-        print("-" * 55)
-
-        for i, p in enumerate(products):
-            json_data = api_responses[i]
+        totals = []
+        for json_data in api_responses:
             total_trend = 0
             if json_data and 'topRequests' in json_data:
                 for item in json_data['topRequests']:
                     total_trend += item.get('count', 0)
-            
-            desc_emb = self.model.encode(f"passage: {p['name']}. {p['description']}", convert_to_tensor=True)
-            
-            m_score = (self._get_score(desc_emb, self.visual_pos, self.visual_neg) + 
-                       self._get_score(desc_emb, self.novelty_pos, self.novelty_neg) + 
-                       self._get_score(desc_emb, self.hype_pos, self.hype_neg)) / 3
-            
-            margin = 0
-            if p['price'] > 0:
-                margin = ((p['price'] - p['market_cost']) / p['price']) * 100
-
-            trend_score = math.log1p(total_trend) * 2.5 
-            final = (m_score * 1.5) + (margin * 0.4) + trend_score
-            
-            processed.append({
-                **p, 
-                "_temp_trend": total_trend, 
-                "_temp_margin": margin, 
-                "_temp_final": final
-            })
-
-        top3_raw = sorted(processed, key=lambda x: x['_temp_final'], reverse=True)[:3]
+            totals.append(total_trend)
+        return totals
+
+    async def _score_chunk(self, products):
+        passages = [f"passage: {p['name']}. {p['description']}" for p in products]
+        if (self.store is None or not self.store.has_all(passages)) and not self.backend.is_loaded():
+            # модель грузится в фоне, пока идут запросы к Wordstat
+            self.backend.warmup()
+
+        trends = await self._trend_totals(products)
+
+        # кодирование занимает секунды — в отдельном потоке, чтобы не блокировать event loop
+        embeddings = await asyncio.to_thread(self._embed_passages, passages)
+        return _score_products(products, trends, self._get_scores(embeddings))
+
+    async def _rank_chunk(self, products, ranking, export):
+        if self._pool is None:
+            for item in await self._score_chunk(products):
+                ranking.push(item['_temp_final'], item)
+                if export is not None:
+                    export.add(item)
+            return
+
+        passages = [f"passage: {p['name']}. {p['description']}" for p in products]
+        trends = await self._trend_totals(products)
+
+        # шарды — подряд идущие куски чанка, по одному на воркер; сливаются в том же порядке
+        step = math.ceil(len(products) / self.workers)
+        jobs = []
+        for start in range(0, len(products), step):
+            texts = passages[start:start + step]
+            if self.store is not None:
+                found, cached, missing = self.store.lookup(texts)
+            else:
+                found, cached, missing = [], None, list(range(len(texts)))
+            jobs.append((products[start:start + step], texts, trends[start:start + step],
+                         found, cached, missing, export is not None))
+
+        results = await asyncio.to_thread(self._pool.map, _score_shard, jobs, 1)
+
+        for job, (shard_ranking, encoded, rows) in zip(jobs, results):
+            texts, missing = job[1], job[5]
+            if self.store is not None and encoded is not None:
+                self.store.add([texts[i] for i in missing], encoded)
+            ranking.merge(shard_ranking)
+            for row in rows or ():
+                export.add(row)
+
+    @staticmethod
+    def _to_output(item):
+        rec_text = (f"Обладает привлекательными визуальными характеристиками: (Score: {item['_temp_final']:.1f}). "
+                    f"Спрос: {item['_temp_trend']} запросов. "
+                    f"Маржинальность: {int(item['_temp_margin'])}%.")
+
+        clean_product = {k: v for k, v in item.items() if not k.startswith('_')}
         
-        final_output = []
+        clean_product['recommendation'] = rec_text
+        
+        return clean_product
+
+    async def run(self):
+        if not os.path.exists(self.JSON_FILE):
+            print(f"Файл {self.JSON_FILE} не найден.")
+            return
+
+        # каталог читается и скорится чанками, в памяти держим только чанк и кучи топ-K
+        ranking = Ranking(self.top_k, self.category_top_k)
+        export = ScoreExport(self.export_path, self.anchor_bank.names) if self.export_path else None
 
-        for item in top3_raw:
-            rec_text = (f"Обладает привлекательными визуальными характеристиками: (Score: {item['_temp_final']:.1f}). "
-                        f"Спрос: {item['_temp_trend']} запросов. "
-                        f"Маржинальность: {int(item['_temp_margin'])}%.")
+        print(f"\n{'ТОВАР':<25} | {'СПРОС (Сумма)':<13} | {'СЧЕТ'}")
+        print("-" * 55)
+
+        if self.workers > 1:
+            self._start_pool()
+
+        try:
+            for chunk in iter_chunks(iter_products(self.JSON_FILE), self.chunk_size):
+                await self._rank_chunk(chunk, ranking, export)
+        finally:
+            await self.wordstat.aclose()
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
 
-            clean_product = {k: v for k, v in item.items() if not k.startswith('_')}
-            
-            clean_product['recommendation'] = rec_text
-            
-            final_output.append(clean_product)
+        final_output = [self._to_output(item) for item in ranking.items()]
 
         output_file = "best_products.json"
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(final_output, f, ensure_ascii=False, indent=4)
+
+        if self.category_top_k is not None:
+            by_category = {category: [self._to_output(item) for item in items]
+                           for category, items in ranking.category_items().items()}
+            with open("best_products_by_category.json", 'w', encoding='utf-8') as f:
+                json.dump(by_category, f, ensure_ascii=False, indent=4)
+
+        if export is not None:
+            export.save()
+
+        return final_output
         
 
 if __name__ == "__main__":
     app = ProductAnalyzer("products.json")
-    asyncio.run(app.run())
\ No newline at end of file
+    asyncio.run(app.run())
@@ -1,12 +1,25 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from dataclasses import asdict, dataclass, fields
+from typing import List, Dict, Any, Iterator, Optional
+import asyncio
+import inspect
 import json
 import os
-import re
+import threading
 
 import httpx
-from main import evaluate_ad  # импортируем оценщик из main.py
+import numpy as np
+
+try:
+    import h2  # noqa: F401 — нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+from json_extract import ExtractError, ExtractResult, JsonStreamExtractor, extract_variants
+from llm_cache import ResponseCache, cache_key
+from llm_resilience import ResilientLLMClient
+from main import evaluate_ads  # импортируем оценщик из main.py
 
 
 # ==========================
@@ -164,6 +177,31 @@ class AdVariant:
     text: str
     cta: str
     notes: str
+    # True — это не ответ модели, а заглушка запасного клиента (API был недоступен); модель это поле не пишет
+    fallback: bool = False
+
+
+# Поля, которые заполняет модель
+VARIANT_FIELDS = [f.name for f in fields(AdVariant) if f.name != "fallback"]
+
+
+# JSON Schema ответа для response_format (structured outputs): {"variants": [AdVariant, ...]}
+AD_VARIANTS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "variants": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {name: {"type": "string"} for name in VARIANT_FIELDS},
+                "required": VARIANT_FIELDS,
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["variants"],
+    "additionalProperties": False,
+}
 
 
 # ==========================
@@ -172,99 +210,581 @@ class AdVariant:
 
 MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
 
+# Свой OpenAI-совместимый сервер (llama.cpp server, vLLM): базовый URL без /chat/completions
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8080/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")  # vLLM ждёт имя из --served-model-name, llama.cpp — любое
+# /v1/completions не применяет чат-шаблон модели, поэтому промпт собираем сами (формат инструкций Mistral)
+LOCAL_PROMPT_TEMPLATE = "[INST] {system}\n\n{user} [/INST]"
+
+
+def _variants_from_content(content: str, payload: Dict[str, Any]) -> List[AdVariant]:
+    """
+    Разбирает content ответа модели в список AdVariant.
+    Битые варианты отбрасываются, ошибка — только если не удалось разобрать ни одного.
+    """
+    result = extract_variants(content, lambda v: _variant_from_dict(v, payload))
+    if not result.variants:
+        # чтобы легче отлаживать, выкидываем понятную ошибку
+        raise ExtractError(
+            f"Не удалось распарсить JSON из ответа Mistral. "
+            f"Сырой контент:\n{content[:500]}\nОшибка: {'; '.join(result.errors)}"
+        )
+    _report_partial(result)
+    return result.variants
+
+
+def _report_partial(result: ExtractResult) -> None:
+    if result.errors:
+        print(f"Разобрано вариантов: {len(result.variants)}, отброшено: {'; '.join(result.errors)}")
+
+
+def _variant_from_dict(v: Dict[str, Any], payload: Dict[str, Any]) -> AdVariant:
+    """
+    Проверяет сырой вариант по схеме AdVariant: все поля — строки, headline и text не пустые.
+    """
+    values = {}
+    for name in VARIANT_FIELDS:
+        value = v.get(name)
+        if name == "channel" and not value:
+            value = payload.get("channel", "")
+        if value is None:
+            value = ""
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            raise ValueError(f"поле {name} должно быть строкой, а не {type(value).__name__}")
+        values[name] = value
+
+    if not values["headline"].strip() or not values["text"].strip():
+        raise ValueError("пустой headline или text")
+    return AdVariant(**values)
+
+
+# Режимы response_format от самого строгого к отсутствию; при отказе API клиент спускается на следующий
+RESPONSE_FORMATS = ("json_schema", "json_object", None)
+
+# Отказ именно от режима, а не от запроса вообще: текст ошибки 400/422 упоминает одно из этих слов
+FORMAT_ERROR_MARKERS = ("response_format", "json_schema", "json_object")
+
+# Для llama.cpp-сервера: держать KV-кэш общего префикса (SYSTEM_PROMPT) в слоте между запросами,
+# чтобы он не считался заново. vLLM делает то же сам при --enable-prefix-caching, поле он игнорирует.
+LOCAL_PREFIX_CACHE_BODY: Dict[str, Any] = {"cache_prompt": True}
+
+
+class ParseStats:
+    """
+    Счётчики разбора ответов по режиму response_format:
+    replies — сколько ответов разбиралось, failures — сколько не дали ни одного варианта
+    (такой ответ приходится генерировать заново), short — вариантов меньше, чем n_variants.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, mode: Optional[str], failed: bool, short: bool = False) -> None:
+        with self._lock:
+            c = self.counts.setdefault(str(mode), {"replies": 0, "failures": 0, "short": 0})
+            c["replies"] += 1
+            c["failures"] += int(failed)
+            c["short"] += int(short)
+
+    def failure_rate(self, mode: Optional[str]) -> float:
+        c = self.counts.get(str(mode))
+        return c["failures"] / c["replies"] if c and c["replies"] else 0.0
+
+
+# Ключи payload от общих для многих запросов к уникальным для товара. Провайдеры (и llama.cpp / vLLM)
+# переиспользуют вычисленный префикс промпта, только если он совпадает побайтно: SYSTEM_PROMPT неизменен,
+# а за ним в массовом прогоне идут одинаковые n_variants / channel / аудитория / тренды, и только потом товар.
+PAYLOAD_KEY_ORDER = ("n_variants", "channel", "audience_profile", "trends", "product")
+
+
+def serialize_payload(payload: Dict[str, Any]) -> str:
+    """
+    Каноничный текст user-сообщения: ключи верхнего уровня в порядке PAYLOAD_KEY_ORDER
+    (остальные — по алфавиту после них), вложенные — по алфавиту, без лишних пробелов.
+    Один и тот же payload всегда даёт одни и те же байты, как бы ни был собран dict.
+    """
+    keys = [k for k in PAYLOAD_KEY_ORDER if k in payload]
+    keys += sorted(k for k in payload if k not in PAYLOAD_KEY_ORDER)
+    parts = [
+        json.dumps(k, ensure_ascii=False) + ":" + json.dumps(payload[k], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        for k in keys
+    ]
+    return "{" + ",".join(parts) + "}"
+
 
-def _extract_json_from_content(content: str) -> Dict[str, Any]:
+def usage_tokens(data: Dict[str, Any]) -> Optional[Dict[str, int]]:
     """
-    Пытается аккуратно вытащить JSON из произвольного текста LLM.
-    1) режем по ```json ... ``` если есть
-    2) если нет — берем подстроку от первой '{' до последней '}'
-    3) парсим json.loads
+    {"prompt_tokens", "cached_tokens"} из ответа API или None, если usage нет.
+    cached_tokens — usage.prompt_tokens_details.cached_tokens (Mistral / OpenAI-совместимые),
+    у llama.cpp — timings.cache_n.
     """
-    if not isinstance(content, str):
-        raise ValueError(f"Ожидалась строка с JSON, но пришло: {type(content)}")
+    usage = data.get("usage") or {}
+    if "prompt_tokens" not in usage:
+        return None
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached is None:
+        cached = (data.get("timings") or {}).get("cache_n", 0)
+    return {"prompt_tokens": int(usage["prompt_tokens"]), "cached_tokens": int(cached or 0)}
 
-    # 1. Попробуем найти блок ```json ... ```
-    code_block = re.search(r"```json(.*?)```", content, flags=re.DOTALL | re.IGNORECASE)
-    if code_block:
-        candidate = code_block.group(1).strip()
-        return json.loads(candidate)
 
-    # 2. Если нет code-block, берем от первой { до последней }
-    start = content.find("{")
-    end = content.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        candidate = content[start : end + 1].strip()
-        return json.loads(candidate)
+class PrefixStats:
+    """
+    Насколько запросы переиспользуют префикс промпта:
+    - prompt_tokens / cached_tokens — по usage из ответов (если API их отдаёт);
+    - prompt_chars / shared_chars — оценка на стороне клиента: сколько символов от начала
+      system + user совпало с предыдущим запросом (видно, даже когда API про кэш молчит).
+    """
 
-    # 3. Последняя попытка — может, это уже чистый JSON
-    return json.loads(content)
+    def __init__(self):
+        self.counts = {"requests": 0, "prompt_chars": 0, "shared_chars": 0, "replies": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self._last_prompt = ""
+        self._lock = threading.Lock()
+
+    def record_prompt(self, prompt: str) -> None:
+        with self._lock:
+            shared = len(os.path.commonprefix([self._last_prompt, prompt]))
+            self._last_prompt = prompt
+            self.counts["requests"] += 1
+            self.counts["prompt_chars"] += len(prompt)
+            self.counts["shared_chars"] += shared
+
+    def record_usage(self, data: Dict[str, Any]) -> None:
+        tokens = usage_tokens(data)
+        if tokens is None:
+            return
+        with self._lock:
+            self.counts["replies"] += 1
+            self.counts["prompt_tokens"] += tokens["prompt_tokens"]
+            self.counts["cached_tokens"] += tokens["cached_tokens"]
+
+    def shared_rate(self) -> float:
+        c = self.counts
+        return c["shared_chars"] / c["prompt_chars"] if c["prompt_chars"] else 0.0
+
+    def cached_rate(self) -> float:
+        c = self.counts
+        return c["cached_tokens"] / c["prompt_tokens"] if c["prompt_tokens"] else 0.0
+
+    def summary(self) -> str:
+        c = self.counts
+        return (
+            f"префикс: совпало {self.shared_rate():.1%} символов промпта с предыдущим запросом, "
+            f"из кэша {c['cached_tokens']} из {c['prompt_tokens']} входных токенов ({self.cached_rate():.1%})"
+        )
 
 
 class MistralClient:
     """
     Клиент для Mistral API.
     Ожидает переменную окружения MISTRAL_API_KEY.
+    cache — необязательный ResponseCache; use_cache=False в generate_variants
+    пропускает чтение из кэша, когда нужны свежие варианты.
+    response_format — "json_schema" (ответ по схеме AD_VARIANTS_SCHEMA), "json_object" (просто JSON)
+    или None (только просьба в SYSTEM_PROMPT). Если API отвечает 400/422 с ошибкой про сам режим,
+    запрос повторяется в следующем из RESPONSE_FORMATS, и для этой модели клиент дальше начинает
+    с него (active_format); разбор ответа в любом режиме тот же.
+    Запрос собирается так, чтобы префикс промпта совпадал между вызовами (SYSTEM_PROMPT,
+    затем serialize_payload); prefix_stats считает, насколько это срабатывает.
+    extra_body — поля, которые дописываются в тело запроса как есть: например,
+    LOCAL_PREFIX_CACHE_BODY для llama.cpp-совместимого сервера, который держит KV-кэш префикса.
     """
 
-    def __init__(self, model: str = "mistral-small-latest"):
-        api_key = os.getenv("MISTRAL_API_KEY")
+    def __init__(
+        self,
+        model: str = "mistral-small-latest",
+        api_url: str = MISTRAL_API_URL,
+        cache: Optional[ResponseCache] = None,
+        temperature: float = 0.85,
+        response_format: Optional[str] = "json_schema",
+        extra_body: Optional[Dict[str, Any]] = None,
+        api_key: Optional[str] = None,
+    ):
+        api_key = api_key or os.getenv("MISTRAL_API_KEY")
         if not api_key:
             raise ValueError("MISTRAL_API_KEY не задан в переменных окружения!")
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"response_format должен быть одним из {RESPONSE_FORMATS}")
         self.api_key = api_key
         self.model = model
-
-    def generate_variants(self, payload: Dict[str, Any]) -> List[AdVariant]:
+        self.api_url = api_url
+        self.cache = cache
+        self.temperature = temperature
+        self.response_format = response_format
+        self._model_formats: Dict[str, Optional[str]] = {}  # модель -> режим после подтверждённого отказа API
+        self.extra_body = dict(extra_body or {})
+        self.parse_stats = ParseStats()
+        self.prefix_stats = PrefixStats()
+        self._http_client: Optional[httpx.Client] = None
+        self._http_lock = threading.Lock()
+
+    def _http(self) -> httpx.Client:
+        # один пул соединений на клиента: новый httpx.Client на каждый запрос — это ~50 мс на SSL-контекст
+        if self._http_client is None:
+            with self._http_lock:
+                if self._http_client is None:
+                    self._http_client = httpx.Client()
+        return self._http_client
+
+    def close(self) -> None:
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+    @property
+    def active_format(self) -> Optional[str]:
+        """Режим response_format, с которого начнётся следующий запрос к текущей модели."""
+        return self._model_formats.get(self.model, self.response_format)
+
+    def _record_prompt(self, payload: Dict[str, Any]) -> None:
+        # один раз на запрос, после того как API его принял: повторы и понижение режима не в счёт
+        self.prefix_stats.record_prompt(SYSTEM_PROMPT + serialize_payload(payload))
+
+    def _build_body(self, payload: Dict[str, Any], mode: Optional[str]) -> Dict[str, Any]:
+        user_content = serialize_payload(payload)
         body = {
             "model": self.model,
             "messages": [
                 {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+                {"role": "user", "content": user_content},
             ],
-            "temperature": 0.85,
+            "temperature": self.temperature,
         }
+        if mode == "json_schema":
+            body["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "ad_variants", "schema": AD_VARIANTS_SCHEMA, "strict": True},
+            }
+        elif mode == "json_object":
+            body["response_format"] = {"type": "json_object"}
+        body.update(self.extra_body)
+        return body
 
-        headers = {
+    def _downgrade_format(self, resp: httpx.Response, mode: Optional[str]) -> Optional[str]:
+        """
+        Более мягкий режим, если API отверг именно режим mode (400/422, в тексте ошибки —
+        FORMAT_ERROR_MARKERS), иначе None: прочие 400/422 (битый запрос, длинный промпт)
+        режим не меняют и уходят в raise_for_status.
+        Подтверждённый отказ запоминается для модели, чтобы не платить лишним запросом каждый раз;
+        если параллельный запрос уже спустился ниже, выше не поднимаемся.
+        """
+        if resp.status_code not in (400, 422) or mode is None:
+            return None
+        resp.read()  # у потокового ответа тело ошибки ещё не прочитано
+        error_text = resp.text.lower()
+        if not any(marker in error_text for marker in FORMAT_ERROR_MARKERS):
+            return None
+        lower = RESPONSE_FORMATS[RESPONSE_FORMATS.index(mode) + 1]
+        with self._http_lock:
+            if RESPONSE_FORMATS.index(self.active_format) < RESPONSE_FORMATS.index(lower):
+                self._model_formats[self.model] = lower
+        return lower
+
+    def _parse_reply(self, content: str, payload: Dict[str, Any], mode: Optional[str]) -> List[AdVariant]:
+        try:
+            variants = _variants_from_content(content, payload)
+        except ValueError:
+            self.parse_stats.record(mode, failed=True)
+            raise
+        self.parse_stats.record(mode, failed=False, short=len(variants) < payload.get("n_variants", 1))
+        return variants
+
+    def _cache_params(self, mode: Optional[str]) -> Dict[str, Any]:
+        # ответы в разных режимах response_format и с разными extra_body — разные записи кэша
+        return {"response_format": mode, "extra_body": self.extra_body}
+
+    def _cache_key(self, payload: Dict[str, Any], params: Dict[str, Any]) -> str:
+        return cache_key(self.model, SYSTEM_PROMPT, payload, self.temperature, params)
+
+    def _from_cache(
+        self, payload: Dict[str, Any], use_cache: bool, params: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[AdVariant]]:
+        """params по умолчанию — режим, в котором ушёл бы следующий запрос (active_format)."""
+        if self.cache is None or not use_cache:
+            return None
+        cached = self.cache.get(self._cache_key(payload, params or self._cache_params(self.active_format)))
+        if cached is None:
+            return None
+        return [AdVariant(**v) for v in cached]
+
+    def _to_cache(self, payload: Dict[str, Any], variants: List[AdVariant], params: Dict[str, Any]) -> None:
+        # свежий ответ сохраняем и при use_cache=False — он заменит старую запись
+        if self.cache is not None and variants:
+            self.cache.put(self._cache_key(payload, params), [asdict(v) for v in variants])
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
-        resp = httpx.post(MISTRAL_API_URL, headers=headers, json=body, timeout=40.0)
+    def generate_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> List[AdVariant]:
+        cached = self._from_cache(payload, use_cache)
+        if cached is not None:
+            return cached
+
+        mode = self.active_format
+        while True:
+            resp = self._http().post(self.api_url, headers=self._headers(), json=self._build_body(payload, mode), timeout=40.0)
+            lower = self._downgrade_format(resp, mode)
+            if lower is None:
+                break
+            mode = lower
         resp.raise_for_status()
+        self._record_prompt(payload)
         data = resp.json()
+        self.prefix_stats.record_usage(data)
 
         content = data["choices"][0]["message"]["content"]
+        variants = self._parse_reply(content, payload, mode)
+        self._to_cache(payload, variants, self._cache_params(mode))
+        return variants
 
-        # --- аккуратно вытаскиваем JSON ---
-        try:
-            parsed = _extract_json_from_content(content)
-        except Exception as e:
-            # чтобы легче отлаживать, выкидываем понятную ошибку
-            raise ValueError(
-                f"Не удалось распарсить JSON из ответа Mistral. "
-                f"Сырой контент:\n{content[:500]}\nОшибка: {e}"
-            ) from e
-
-        variants_raw = parsed.get("variants", [])
-        variants: List[AdVariant] = []
-        for v in variants_raw:
-            variants.append(
-                AdVariant(
-                    channel=v.get("channel", payload.get("channel", "")),
-                    headline=v.get("headline", ""),
-                    text=v.get("text", ""),
-                    cta=v.get("cta", ""),
-                    notes=v.get("notes", ""),
-                )
+    def stream_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> Iterator[AdVariant]:
+        """
+        Потоковая генерация (SSE, stream=true): отдаёт каждый вариант,
+        как только модель дописала его JSON-объект, не дожидаясь конца ответа.
+        """
+        cached = self._from_cache(payload, use_cache)
+        if cached is not None:
+            yield from cached
+            return
+
+        extractor = JsonStreamExtractor(lambda v: _variant_from_dict(v, payload))
+        content_parts: List[str] = []
+
+        mode = self.active_format
+        while True:
+            body = self._build_body(payload, mode)
+            body["stream"] = True
+            with self._http().stream("POST", self.api_url, headers=self._headers(), json=body, timeout=40.0) as resp:
+                lower = self._downgrade_format(resp, mode)
+                if lower is not None:
+                    mode = lower
+                    continue
+                resp.raise_for_status()
+                self._record_prompt(payload)
+                for line in resp.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    self.prefix_stats.record_usage(chunk)  # usage приходит в последнем куске
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta", {}).get("content") or ""
+                    content_parts.append(delta)
+                    yield from extractor.feed(delta)
+            break
+
+        result = extractor.finish()
+        variants = result.variants
+        if variants:
+            _report_partial(result)
+            self.parse_stats.record(mode, failed=False, short=len(variants) < payload.get("n_variants", 1))
+        else:
+            # ответ пришёл не в ожидаемой форме — разбираем его целиком обычным путём
+            variants = self._parse_reply("".join(content_parts), payload, mode)
+            yield from variants
+
+        self._to_cache(payload, variants, self._cache_params(mode))
+
+
+class AsyncMistralClient(MistralClient):
+    """
+    Асинхронный клиент Mistral для массовой генерации:
+    - один httpx.AsyncClient (HTTP/2, keep-alive) на все запросы;
+    - не больше max_concurrency запросов одновременно;
+    - deadline секунд на каждый запрос (без учёта ожидания в очереди).
+    api_url можно направить на локальный мок-сервер; api_key — вместо MISTRAL_API_KEY.
+    """
+
+    def __init__(
+        self,
+        model: str = "mistral-small-latest",
+        api_url: str = MISTRAL_API_URL,
+        max_concurrency: int = 16,
+        deadline: float = 40.0,
+        cache: Optional[ResponseCache] = None,
+        temperature: float = 0.85,
+        response_format: Optional[str] = "json_schema",
+        extra_body: Optional[Dict[str, Any]] = None,
+        api_key: Optional[str] = None,
+    ):
+        super().__init__(
+            model=model,
+            api_url=api_url,
+            cache=cache,
+            temperature=temperature,
+            response_format=response_format,
+            extra_body=extra_body,
+            api_key=api_key,
+        )
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # клиент и семафор привязаны к event loop, поэтому создаём их внутри него
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=self.deadline,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                headers=self._headers(),
             )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "AsyncMistralClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def generate_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> List[AdVariant]:
+        cached = self._from_cache(payload, use_cache)
+        if cached is not None:
+            return cached
+
+        client = self._get_client()
+        async with self._semaphore:
+            mode = self.active_format
+            while True:
+                resp = await asyncio.wait_for(
+                    client.post(self.api_url, json=self._build_body(payload, mode)),
+                    timeout=self.deadline,
+                )
+                lower = self._downgrade_format(resp, mode)
+                if lower is None:
+                    break
+                mode = lower
+        resp.raise_for_status()
+        self._record_prompt(payload)
+        data = resp.json()
+        self.prefix_stats.record_usage(data)
+
+        content = data["choices"][0]["message"]["content"]
+        variants = self._parse_reply(content, payload, mode)
+        self._to_cache(payload, variants, self._cache_params(mode))
         return variants
 
 
+class LocalLLMClient(MistralClient):
+    """
+    Клиент для своего OpenAI-совместимого сервера (llama.cpp server, vLLM) по адресу base_url.
+    generate_variants / stream_variants — как у MistralClient, через {base_url}/chat/completions.
+    generate_batch — много payload'ов одним запросом к {base_url}/completions: prompt — список,
+    сервер прогоняет его одним батчем. SYSTEM_PROMPT стоит в начале каждого промпта,
+    так что с LOCAL_PREFIX_CACHE_BODY его префикс считается один раз.
+    Ключ нужен, только если сервер запущен с --api-key (LOCAL_LLM_API_KEY).
+    """
+
+    def __init__(
+        self,
+        model: str = LOCAL_LLM_MODEL,
+        base_url: str = LOCAL_LLM_URL,
+        cache: Optional[ResponseCache] = None,
+        temperature: float = 0.85,
+        response_format: Optional[str] = "json_schema",
+        extra_body: Optional[Dict[str, Any]] = LOCAL_PREFIX_CACHE_BODY,
+        max_batch_size: int = 16,
+        max_tokens: int = 1024,
+        prompt_template: str = LOCAL_PROMPT_TEMPLATE,
+        timeout: float = 120.0,
+    ):
+        base_url = base_url.rstrip("/")
+        super().__init__(
+            model=model,
+            api_url=base_url + "/chat/completions",
+            cache=cache,
+            temperature=temperature,
+            response_format=response_format,
+            extra_body=extra_body,
+            api_key=os.getenv("LOCAL_LLM_API_KEY") or "local",
+        )
+        self.completions_url = base_url + "/completions"
+        self.max_batch_size = max_batch_size
+        self.max_tokens = max_tokens  # у vLLM по умолчанию всего 16 токенов на ответ
+        self.prompt_template = prompt_template
+        self.timeout = timeout
+
+    def _batch_cache_params(self) -> Dict[str, Any]:
+        # пачка идёт в /completions со своим шаблоном промпта — не то же, что ответ chat/completions
+        return {
+            "endpoint": "completions",
+            "prompt_template": self.prompt_template,
+            "max_tokens": self.max_tokens,
+            "extra_body": self.extra_body,
+        }
+
+    def _render_prompt(self, payload: Dict[str, Any]) -> str:
+        return self.prompt_template.format(system=SYSTEM_PROMPT, user=serialize_payload(payload))
+
+    def generate_batch(
+        self, payloads: List[Dict[str, Any]], use_cache: bool = True, retry_failed: bool = True
+    ) -> List[Optional[List[AdVariant]]]:
+        """
+        Варианты для каждого payload, в том же порядке. Ответы из кэша в запрос не идут,
+        остальные уходят пачками по max_batch_size. Если ответ на один промпт не разобрался,
+        этот payload повторяется обычным запросом generate_variants, а не роняет всю пачку;
+        с retry_failed=False на его месте остаётся None — повтор делает вызывающий
+        (ResilientLLMClient — со своими повторами, breaker и запасным ответом).
+        """
+        params = self._batch_cache_params()
+        results: List[Optional[List[AdVariant]]] = [self._from_cache(p, use_cache, params) for p in payloads]
+        todo = [i for i, cached in enumerate(results) if cached is None]
+
+        for start in range(0, len(todo), self.max_batch_size):
+            chunk = todo[start : start + self.max_batch_size]
+            body = {
+                "model": self.model,
+                "prompt": [self._render_prompt(payloads[i]) for i in chunk],
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+            }
+            body.update(self.extra_body)
+            resp = self._http().post(self.completions_url, headers=self._headers(), json=body, timeout=self.timeout)
+            resp.raise_for_status()
+            for prompt in body["prompt"]:
+                self.prefix_stats.record_prompt(prompt)
+            data = resp.json()
+            self.prefix_stats.record_usage(data)
+
+            # choices могут прийти не по порядку — раскладываем по index
+            texts = {c.get("index", k): c.get("text", "") for k, c in enumerate(data["choices"])}
+            for k, i in enumerate(chunk):
+                try:
+                    variants = self._parse_reply(texts.get(k, ""), payloads[i], "completions")
+                except ValueError as e:
+                    print(f"Ответ {i + 1} из пачки не разобрался ({e}), повторяем отдельным запросом")
+                    variants = self.generate_variants(payloads[i], use_cache=False) if retry_failed else None
+                else:
+                    self._to_cache(payloads[i], variants, params)
+                results[i] = variants
+
+        return results
+
+
 class MockLLMClient:
     """
     Заглушка вместо Mistral — для отладки без API.
     """
 
-    def generate_variants(self, payload: Dict[str, Any]) -> List[AdVariant]:
+    def generate_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> List[AdVariant]:
         p = payload["product"]
         channel = payload["channel"]
         name = p.get("name", "товар")
@@ -296,6 +816,9 @@ class MockLLMClient:
             )
         ]
 
+    def stream_variants(self, payload: Dict[str, Any], use_cache: bool = True) -> Iterator[AdVariant]:
+        yield from self.generate_variants(payload)
+
 
 # Для обратной совместимости
 LLMClient = MistralClient
@@ -371,6 +894,42 @@ def build_request_from_input_json(input_json: Dict[str, Any]) -> GenerationReque
     return req
 
 
+# Аудитория и тренды по умолчанию для записей каталога, где их нет
+DEFAULT_AUDIENCE: Dict[str, Any] = {
+    "age_range": "20-35",
+    "interests": ["гаджеты", "технологии"],
+    "behavior": ["реагирует на скидки"],
+}
+DEFAULT_TRENDS: List[str] = ["минимализм", "FOMO"]
+
+
+def _number_or_none(value: Any) -> Optional[float]:
+    # в CSV пустая ячейка приходит строкой "", в JSON цены может не быть вовсе
+    if isinstance(value, bool) or value in (None, ""):
+        return None
+    try:
+        return float(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+
+
+def product_from_catalog_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Товар из каталога / best_products.json (name, description, price, market_cost)
+    в формат product для LLM. Пустая или отсутствующая цена — "price": None, наценка "средняя".
+    """
+    price = _number_or_none(item.get("price"))
+    market_cost = _number_or_none(item.get("market_cost")) or 0
+    return {
+        "name": item.get("name", ""),
+        "category": item.get("category", ""),
+        "price": price,
+        "margin": "высокая" if price is not None and price > market_cost * 1.5 else "средняя",
+        "tags": item.get("tags", []),
+        "features": [item.get("description", "")],
+    }
+
+
 # ==========================
 # 5. FORMATTERS (человекочитаемый текст)
 # ==========================
@@ -437,10 +996,12 @@ class AdGenerator:
         self,
         input_json: Dict[str, Any],
         return_human_texts: bool = True,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         Основной метод:
         - input_json: то, что тебе кидают другие части системы (каталог/симуляция).
+        - use_cache=False: не брать ответ из кэша клиента (нужны новые варианты).
         Возвращает dict:
             "variants": List[AdVariant как dict]
             "texts": List[str] (если return_human_texts=True)
@@ -448,7 +1009,81 @@ class AdGenerator:
         req = build_request_from_input_json(input_json)
         payload = build_payload_from_request(req)
 
-        variants = self.llm_client.generate_variants(payload)
+        variants = self.llm_client.generate_variants(payload, use_cache=use_cache)
+        return self._to_result(variants, return_human_texts)
+
+    async def agenerate_from_json_dict(
+        self,
+        input_json: Dict[str, Any],
+        return_human_texts: bool = True,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        То же, что generate_from_json_dict, но для асинхронного клиента (AsyncMistralClient).
+        Синхронные клиенты (MockLLMClient) тоже поддерживаются.
+        """
+        req = build_request_from_input_json(input_json)
+        payload = build_payload_from_request(req)
+
+        variants = self.llm_client.generate_variants(payload, use_cache=use_cache)
+        if inspect.isawaitable(variants):
+            variants = await variants
+        return self._to_result(variants, return_human_texts)
+
+    def stream_from_json_dict(
+        self,
+        input_json: Dict[str, Any],
+        use_cache: bool = True,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Отдаёт варианты (как dict) по одному, по мере готовности —
+        для интерфейса, который рисует карточку сразу, как только она готова.
+        """
+        req = build_request_from_input_json(input_json)
+        payload = build_payload_from_request(req)
+
+        stream = getattr(self.llm_client, "stream_variants", None)
+        if stream is None:
+            variants = self.llm_client.generate_variants(payload, use_cache=use_cache)
+        else:
+            variants = stream(payload, use_cache=use_cache)
+
+        for v in variants:
+            yield asdict(v)
+
+    async def agenerate_many(
+        self,
+        inputs: List[Dict[str, Any]],
+        return_human_texts: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Генерирует креативы для многих входов конкурентно; порядок результатов совпадает с inputs.
+        Ограничение параллелизма — на стороне клиента (max_concurrency).
+        """
+        return await asyncio.gather(
+            *(self.agenerate_from_json_dict(x, return_human_texts) for x in inputs)
+        )
+
+    def generate_batch_from_json_dicts(
+        self,
+        inputs: List[Dict[str, Any]],
+        return_human_texts: bool = True,
+        use_cache: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Генерирует креативы для многих входов; если клиент умеет generate_batch (LocalLLMClient),
+        входы уходят пачками, иначе — по одному. Порядок результатов совпадает с inputs.
+        """
+        payloads = [build_payload_from_request(build_request_from_input_json(x)) for x in inputs]
+        batch = getattr(self.llm_client, "generate_batch", None)
+        if batch is not None:
+            results = batch(payloads, use_cache=use_cache)
+        else:
+            results = [self.llm_client.generate_variants(p, use_cache=use_cache) for p in payloads]
+        return [self._to_result(variants, return_human_texts) for variants in results]
+
+    @staticmethod
+    def _to_result(variants: List[AdVariant], return_human_texts: bool) -> Dict[str, Any]:
         texts: List[str] = []
         if return_human_texts:
             texts = format_all_variants_human_readable(variants)
@@ -460,6 +1095,7 @@ class AdGenerator:
                 "text": v.text,
                 "cta": v.cta,
                 "notes": v.notes,
+                "fallback": v.fallback,
             }
             for v in variants
         ]
@@ -471,7 +1107,7 @@ class AdGenerator:
 
 
 # ==========================
-# 7. ОПТИМИЗАЦИЯ РЕКЛАМЫ ЧЕРЕЗ main.evaluate_ad
+# 7. ОПТИМИЗАЦИЯ РЕКЛАМЫ ЧЕРЕЗ main.evaluate_ads
 # ==========================
 
 BEST_CLICK_THRESHOLD = 0.7   # порог "достаточно хорошей" вероятности клика
@@ -487,7 +1123,7 @@ def generate_and_optimize_ad(
 ) -> Dict[str, Any]:
     """
     1) Генерирует варианты рекламы через AdGenerator.
-    2) Для каждого варианта вызывает main.evaluate_ad(ad_text, target_audience).
+    2) Оценивает все варианты одним вызовом main.evaluate_ads(ad_texts, target_audience).
     3) Выбирает лучший вариант по click_probability.
     4) Если на какой-то итерации найден вариант с click_probability >= порога —
        сразу возвращаем его.
@@ -502,30 +1138,36 @@ def generate_and_optimize_ad(
     best_variant: Optional[Dict[str, Any]] = None
     best_scores: Optional[Dict[str, float]] = None
 
-    for _ in range(max_iters):
-        result = generator.generate_from_json_dict(input_json, return_human_texts=False)
+    for iteration in range(max_iters):
+        # со второй итерации нужны новые варианты, а не тот же ответ из кэша
+        result = generator.generate_from_json_dict(
+            input_json, return_human_texts=False, use_cache=iteration == 0
+        )
         variants = result["variants"]
+        if not variants:
+            continue
+
+        # Собираем тексты объявлений (заголовок + текст + CTA) и оцениваем всю пачку разом
+        ad_texts = [f"{v['headline']}\n{v['text']}\n{v['cta']}" for v in variants]
+        batch = evaluate_ads(ad_texts, target_audience)
+        clicks = batch["click_probability"]
+
+        # Если есть достаточно хороший вариант — сразу возвращаем первый такой
+        good = np.flatnonzero(clicks >= best_click_threshold)
+        i = int(good[0]) if good.size else int(np.argmax(clicks))
+        scores = {key: float(values[i]) for key, values in batch.items()}
+
+        if good.size:
+            return {
+                "ad_text": ad_texts[i],
+                "variant": variants[i],
+                "scores": scores,
+            }
 
-        for v in variants:
-            # Собираем текст объявления (заголовок + текст + CTA)
-            ad_text = f"{v['headline']}\n{v['text']}\n{v['cta']}"
-
-            # Оцениваем рекламу через main.evaluate_ad
-            scores = evaluate_ad(ad_text, target_audience)
-            click_p = scores.get("click_probability", 0.0)
-
-            # Обновляем лучший, если нужно
-            if best_scores is None or click_p > best_scores.get("click_probability", 0.0):
-                best_scores = scores
-                best_variant = v
-
-            # Если вариант достаточно хорош — сразу возвращаем
-            if click_p >= best_click_threshold:
-                return {
-                    "ad_text": ad_text,
-                    "variant": v,
-                    "scores": scores,
-                }
+        # Обновляем лучший, если нужно
+        if best_scores is None or scores["click_probability"] > best_scores["click_probability"]:
+            best_scores = scores
+            best_variant = variants[i]
 
     # Если порог так и не достигнут — возвращаем лучший из того, что было
     if best_variant is not None and best_scores is not None:
@@ -543,13 +1185,32 @@ def generate_and_optimize_ad(
 # 8. MAIN (запуск для проверки)
 # ==========================
 
-def get_llm_client(use_mistral: bool = True):
+LLM_BACKENDS = ("mistral", "local", "mock")
+
+
+def get_llm_client(
+    use_mistral: bool = True,
+    cache: Optional[ResponseCache] = None,
+    backend: Optional[str] = None,
+):
     """
-    Возвращает либо реальный MistralClient, либо MockLLMClient.
+    Возвращает клиента LLM для backend:
+    - "mistral" — MistralClient (Mistral API);
+    - "local" — LocalLLMClient (свой OpenAI-совместимый сервер, LOCAL_LLM_URL);
+    - "mock" — MockLLMClient.
+    По умолчанию backend берётся из переменной LLM_BACKEND, а без неё — "mistral".
+    use_mistral=False, как и раньше, всегда даёт MockLLMClient.
+    Настоящий клиент обёрнут в ResilientLLMClient: повторы на 429/5xx/битый JSON,
+    а если сервер недоступен — ответ из кэша или MockLLMClient вместо ошибки.
+    Для массовой асинхронной генерации используйте AsyncMistralClient напрямую.
     """
-    if use_mistral:
-        return MistralClient()
-    return MockLLMClient()
+    backend = backend or os.getenv("LLM_BACKEND", "mistral")
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"backend должен быть одним из {LLM_BACKENDS}, а не {backend!r}")
+    if not use_mistral or backend == "mock":
+        return MockLLMClient()
+    primary = LocalLLMClient(cache=cache) if backend == "local" else MistralClient(cache=cache)
+    return ResilientLLMClient(primary, fallback=MockLLMClient())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+import heapq
+
+import numpy as np
+
+
+class TopK:
+    """
+    k лучших элементов по score без полной сортировки: min-куча размера k.
+    При равных score выигрывает элемент, добавленный раньше (как у стабильной сортировки).
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        self._seq = 0
+
+    def push(self, score, item):
+        self._seq += 1
+        if self.k <= 0:
+            return
+
+        entry = (score, -self._seq, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self):
+        return [entry[2] for entry in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+    def merge(self, other):
+        """
+        Добавляет k лучших другой кучи (например, собранной воркером по своему шарду) в порядке их места.
+        Если шарды сливаются в порядке каталога, при равных score результат тот же, что у одной общей кучи.
+        """
+        for entry in sorted(other._heap, key=lambda e: e[:2], reverse=True):
+            self.push(entry[0], entry[2])
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class Ranking:
+    """
+    Общий топ-k плюс, по желанию, топ по каждой категории.
+    category_k: None — без разбивки, int — одинаковый k для всех категорий,
+    dict {категория: k} — только перечисленные категории.
+    """
+
+    def __init__(self, k, category_k=None):
+        self.top = TopK(k)
+        self.category_k = category_k
+        self.by_category = {}
+
+    def push(self, score, item):
+        self.top.push(score, item)
+
+        if self.category_k is None:
+            return
+        category = item.get("category", "")
+        if isinstance(self.category_k, dict):
+            k = self.category_k.get(category, 0)
+        else:
+            k = self.category_k
+        if k <= 0:
+            return
+
+        if category not in self.by_category:
+            self.by_category[category] = TopK(k)
+        self.by_category[category].push(score, item)
+
+    def merge(self, other):
+        """Сливает рейтинг шарда: общий топ и топы категорий (лучшие по каталогу всегда есть среди лучших по шардам)."""
+        self.top.merge(other.top)
+        for category, top in other.by_category.items():
+            if category not in self.by_category:
+                self.by_category[category] = TopK(top.k)
+            self.by_category[category].merge(top)
+
+    def items(self):
+        return self.top.items()
+
+    def category_items(self):
+        return {category: top.items() for category, top in self.by_category.items()}
+
+
+class ScoreExport:
+    """
+    Полная таблица скоров каталога в колоночном .npz (numpy.load читает без модели):
+    name, category, trend, margin, final, axis_<имя оси> — строки отсортированы по final по убыванию.
+    """
+
+    def __init__(self, path, axis_names):
+        self.path = path
+        self.axis_names = list(axis_names)
+        self.columns = {"name": [], "category": [], "trend": [], "margin": [], "final": []}
+        self.axes = []
+
+    @staticmethod
+    def row(item):
+        """Только поля, которые читает add: воркеру незачем пересылать в родителя товар целиком."""
+        keys = ("name", "category", "_temp_trend", "_temp_margin", "_temp_final", "_temp_axes")
+        return {key: item[key] for key in keys if key in item}
+
+    def add(self, item):
+        self.columns["name"].append(str(item.get("name", "")))
+        self.columns["category"].append(str(item.get("category", "")))
+        self.columns["trend"].append(item["_temp_trend"])
+        self.columns["margin"].append(item["_temp_margin"])
+        self.columns["final"].append(item["_temp_final"])
+        self.axes.append(item["_temp_axes"])
+
+    def save(self):
+        final = np.asarray(self.columns["final"], dtype=np.float64)
+        order = np.argsort(-final, kind="stable")
+
+        arrays = {
+            "name": np.asarray(self.columns["name"], dtype=str)[order],
+            "category": np.asarray(self.columns["category"], dtype=str)[order],
+            "trend": np.asarray(self.columns["trend"], dtype=np.int64)[order],
+            "margin": np.asarray(self.columns["margin"], dtype=np.float64)[order],
+            "final": final[order],
+        }
+        axes = np.asarray(self.axes, dtype=np.float32).reshape(len(final), len(self.axis_names))[order]
+        for i, axis in enumerate(self.axis_names):
+            arrays[f"axis_{axis}"] = axes[:, i]
+
+        np.savez_compressed(self.path, **arrays)
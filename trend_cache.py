@@ -0,0 +1,59 @@
+import json
+import sqlite3
+import time
+
+
+def trend_key(phrase, devices):
+    """
+    Ключ кэша: фраза в нижнем регистре со схлопнутыми пробелами + отсортированный набор устройств.
+    """
+    return f"{' '.join(phrase.lower().split())}|{','.join(sorted(devices))}"
+
+
+class TrendCache:
+    """
+    Персистентный кэш ответов Wordstat в SQLite с TTL.
+    Экономит и время, и платную квоту API: варианты одного товара
+    и повторные ночные прогоны не ходят в сеть, пока запись свежая.
+    """
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._connect()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trends (key TEXT PRIMARY KEY, response TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        return self._conn
+
+    @property
+    def conn(self):
+        # после close() (например, на время fork пула воркеров) следующий запрос переоткроет соединение
+        return self._conn if self._conn is not None else self._connect()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT response, fetched_at FROM trends WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO trends (key, response, fetched_at) VALUES (?, ?, ?)",
+            (key, json.dumps(response, ensure_ascii=False), time.time()),
+        )
+        self.conn.commit()
+
+    def purge_expired(self):
+        self.conn.execute("DELETE FROM trends WHERE fetched_at < ?", (time.time() - self.ttl,))
+        self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
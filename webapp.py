@@ -4,10 +4,20 @@ from typing import Any, Dict, List
 
 import streamlit as st
 # Убедитесь, что prompt.py лежит рядом, иначе закомментируйте импорт для теста интерфейса
-from prompt import get_llm_client, AdGenerator
+from llm_cache import ResponseCache
+from prompt import get_llm_client, AdGenerator, product_from_catalog_item, DEFAULT_AUDIENCE, DEFAULT_TRENDS
 
 # Путь к встроенному примеру
 DEFAULT_JSON_PATH = "test.json"
+PLACEHOLDER_IMAGE_URL = "https://i.imgur.com/ilo8Prn.jpeg  "
+
+@st.cache_resource
+def get_cached_llm_client(use_mistral: bool):
+    """
+    Streamlit перезапускает скрипт на каждое действие пользователя,
+    а клиент LLM создаётся один раз на процесс и переиспользуется.
+    """
+    return get_llm_client(use_mistral=use_mistral, cache=ResponseCache())
 
 def parse_products_json(data: Any) -> List[Dict]:
     if isinstance(data, dict):
@@ -17,10 +27,9 @@ def parse_products_json(data: Any) -> List[Dict]:
     else:
         raise ValueError("Ожидался объект JSON или список объектов JSON.")
 
-def generate_creatives(records: List[Dict], user_text: str, llm_client, use_mistral: bool = True) -> Dict[str, Any]:
+def build_creative_payload(records: List[Dict], user_text: str) -> Dict[str, Any]:
     """
-    Генерирует креативы через LLM API.
-    Логика полностью сохранена.
+    Собирает payload для LLM из первой записи: готовый запрос {"product": ...} или товар каталога.
     """
     first = records[0]
 
@@ -31,21 +40,10 @@ def generate_creatives(records: List[Dict], user_text: str, llm_client, use_mist
         trends = first.get("trends", [])
         n_variants = first.get("n_variants", 3)
     else:
-        product = {
-            "name": first.get("name", ""),
-            "category": first.get("category", ""),
-            "price": first.get("price"),
-            "margin": "высокая" if first.get("price", 0) > first.get("market_cost", 0) * 1.5 else "средняя",
-            "tags": first.get("tags", []),
-            "features": [first.get("description", "")]
-        }
-        audience = {
-            "age_range": "20-35",
-            "interests": ["гаджеты", "технологии"],
-            "behavior": ["реагирует на скидки"]
-        }
+        product = product_from_catalog_item(first)
+        audience = dict(DEFAULT_AUDIENCE)
         channel = "telegram"
-        trends = ["минимализм", "FOMO"]
+        trends = list(DEFAULT_TRENDS)
         n_variants = 3
 
     payload = {
@@ -60,24 +58,51 @@ def generate_creatives(records: List[Dict], user_text: str, llm_client, use_mist
         if "user_instructions" not in payload:
             payload["user_instructions"] = user_text.strip()
 
+    return payload
+
+def generate_creatives(records: List[Dict], user_text: str, llm_client, use_mistral: bool = True, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Генерирует креативы через LLM API.
+    Логика полностью сохранена.
+    """
+    payload = build_creative_payload(records, user_text)
+    product = payload["product"]
+    channel = payload["channel"]
+
     generator = AdGenerator(llm_client)
-    result = generator.generate_from_json_dict(payload, return_human_texts=True)
+    result = generator.generate_from_json_dict(payload, return_human_texts=True, use_cache=use_cache)
 
     variants = result.get("variants", [])
     if not variants:
         return {
             "text": "❌ Не удалось сгенерировать креативы. Попробуйте еще раз.",
-            "image_url": "https://i.imgur.com/ilo8Prn.jpeg  ",
+            "image_url": PLACEHOLDER_IMAGE_URL,
         }
 
-    placeholder_image_url = "https://i.imgur.com/ilo8Prn.jpeg  "
     return {
         "variants": variants,
         "channel": channel,
-        "image_url": placeholder_image_url,
+        "image_url": PLACEHOLDER_IMAGE_URL,
         "product": product,
     }
 
+def variant_card_html(idx: int, variant: Dict[str, Any]) -> str:
+    # вариант от запасного клиента (API недоступен) — заглушка, а не ответ модели
+    fallback_badge = ' <span style="color:#f59e0b;">· заглушка</span>' if variant.get("fallback") else ""
+    return f"""
+    <div class="ad-card" style="height: 100%;">
+        <div class="variant-number">Вариант {idx + 1}{fallback_badge}</div>
+        <div class="ad-headline">{variant.get('headline', '')}</div>
+        <div class="ad-text">{variant.get('text', '')}</div>
+        <div style="margin-top:auto;">
+            <span class="ad-cta">CTA: {variant.get('cta', '')}</span>
+        </div>
+        <div class="ad-meta">
+            <strong>Примечания:</strong> {variant.get('notes', 'Нет примечаний')}
+        </div>
+    </div>
+    """
+
 def main():
     st.set_page_config(
         page_title="GENAI-4 интерфейс",
@@ -289,6 +314,11 @@ def main():
         value=True,
         help="Для работы нужен ключ MISTRAL_API_KEY в переменных окружения или secrets.",
     )
+    fresh_variants = st.sidebar.checkbox(
+        "🔄 Новые варианты (без кэша)",
+        value=False,
+        help="По умолчанию одинаковый запрос отдаёт сохранённый ответ без обращения к API.",
+    )
     
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 📊 Информация")
@@ -393,32 +423,20 @@ def main():
 
         # Инициализация LLM
         try:
-            llm_client = get_llm_client(use_mistral=use_real_mistral)
+            llm_client = get_cached_llm_client(use_real_mistral)
         except Exception as e:
             st.error(f"Ошибка инициализации LLM-клиента: {e}")
             if use_real_mistral:
                 st.info("💡 Убедитесь, что переменная окружения MISTRAL_API_KEY установлена, или используйте заглушку.")
             return
 
-        # Генерация
-        with st.spinner("🎨 Генерация креативов... Это может занять несколько секунд"):
-            try:
-                result = generate_creatives(records, user_text, llm_client, use_real_mistral)
-            except Exception as e:
-                st.error(f"❌ Ошибка при генерации: {e}")
-                return
-
-        st.success("✅ Генерация завершена успешно!")
-        st.markdown("<br>", unsafe_allow_html=True)
-
-        # Подготовка данных
-        variants = result.get("variants", [])
-        channel = result.get("channel", "telegram")
-        product = result.get("product", {})
-        
-        if not variants:
-            st.warning("⚠️ Не удалось сгенерировать варианты рекламы. Попробуйте еще раз.")
+        try:
+            payload = build_creative_payload(records, user_text)
+        except Exception as e:
+            st.error(f"❌ Ошибка при генерации: {e}")
             return
+        product = payload["product"]
+        channel = payload["channel"]
 
         # --- КАРТОЧКА ПРОДУКТА ---
         if product:
@@ -447,28 +465,37 @@ def main():
             </div>
             """, unsafe_allow_html=True)
 
-        st.markdown(f"<div class='section-title'>Сгенерировано вариантов: {len(variants)} | Канал: {channel.upper()}</div>", unsafe_allow_html=True)
+        title = st.empty()
         st.markdown(f"<div class='section-sub'>Показаны все варианты рекламных креативов</div>", unsafe_allow_html=True)
 
         # --- ОТОБРАЖЕНИЕ ВАРИАНТОВ ---
-        # Делаем сетку для адаптивности
-        cols = st.columns(len(variants))
-        for idx, variant in enumerate(variants):
-            # Если вариантов много, переносим на новую строку, если мало - в одну линию
-            with cols[idx] if idx < len(cols) else st.container():
-                st.markdown(f"""
-                <div class="ad-card" style="height: 100%;">
-                    <div class="variant-number">Вариант {idx + 1}</div>
-                    <div class="ad-headline">{variant.get('headline', '')}</div>
-                    <div class="ad-text">{variant.get('text', '')}</div>
-                    <div style="margin-top:auto;">
-                        <span class="ad-cta">CTA: {variant.get('cta', '')}</span>
-                    </div>
-                    <div class="ad-meta">
-                        <strong>Примечания:</strong> {variant.get('notes', 'Нет примечаний')}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+        # Сетка готовится заранее, каждая карточка рисуется, как только модель дописала её вариант
+        cols = st.columns(max(1, payload.get("n_variants", 3)))
+        slots = [col.empty() for col in cols]
+        variants = []
+
+        with st.spinner("🎨 Генерация креативов... Варианты появляются по мере готовности"):
+            try:
+                generator = AdGenerator(llm_client)
+                for variant in generator.stream_from_json_dict(payload, use_cache=not fresh_variants):
+                    idx = len(variants)
+                    variants.append(variant)
+                    # Если вариантов больше, чем колонок, переносим на новую строку
+                    slot = slots[idx] if idx < len(slots) else st.container()
+                    slot.markdown(variant_card_html(idx, variant), unsafe_allow_html=True)
+                    title.markdown(f"<div class='section-title'>Сгенерировано вариантов: {len(variants)} | Канал: {channel.upper()}</div>", unsafe_allow_html=True)
+            except Exception as e:
+                st.error(f"❌ Ошибка при генерации: {e}")
+                return
+
+        if not variants:
+            st.warning("⚠️ Не удалось сгенерировать варианты рекламы. Попробуйте еще раз.")
+            return
+
+        if any(v.get("fallback") for v in variants):
+            st.warning("⚠️ LLM API недоступен — показаны варианты-заглушки. Попробуйте сгенерировать позже.")
+        else:
+            st.success("✅ Генерация завершена успешно!")
 
         # Изображение
         st.markdown("---")
@@ -477,7 +504,7 @@ def main():
         # Обертка для картинки, чтобы не прилипала к краям на мобильном
         st.markdown('<div class="glass-container" style="padding: 10px;">', unsafe_allow_html=True)
         st.image(
-            result["image_url"],
+            PLACEHOLDER_IMAGE_URL,
             caption="Здесь будет отображаться сгенерированный баннер/креатив",
             use_container_width=True,
         )
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import httpx
+
+from http_retry import RETRYABLE_STATUSES, backoff_delay, retry_after_seconds
+from trend_cache import trend_key
+
+WORDSTAT_URL = "https://api.wordstat.yandex.net"
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, не больше capacity подряд.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class WordstatClient:
+    """
+    Общий клиент Wordstat API: один пул keep-alive соединений на все запросы,
+    не больше max_concurrency запросов одновременно, не чаще rate_per_second,
+    повтор с джиттером на 429/5xx и сетевых ошибках (Retry-After — не дольше max_backoff секунд).
+    Одинаковые фразы, запрошенные одновременно, делят один HTTP-запрос;
+    с cache (TrendCache) свежие ответы вообще не идут в сеть.
+    base_url можно подменить на локальный стаб-сервер.
+    """
+
+    def __init__(self, token, base_url=WORDSTAT_URL, max_concurrency=10, rate_per_second=10.0,
+                 max_retries=4, timeout=10.0, cache=None, max_backoff=30.0):
+        self.token = token
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+        self.max_backoff = max_backoff  # потолок ожидания, даже если Retry-After просит больше
+
+        self._client = None
+        self._inflight = {}
+
+    def _get_client(self):
+        # клиент, семафор и лимитер привязаны к event loop, поэтому создаём их внутри него
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                headers={
+                    "Content-Type": "application/json; charset=utf-8",
+                    "Authorization": f"Bearer {self.token}",
+                },
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._bucket = TokenBucket(self.rate_per_second)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def top_requests(self, phrase, devices=("phone", "desktop")):
+        """
+        POST /v1/topRequests. Возвращает JSON ответа;
+        после исчерпания повторов пробрасывает последнюю ошибку httpx.
+        """
+        key = trend_key(phrase, devices)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, phrase, devices))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, phrase, devices):
+        response = await self._post_with_retries(phrase, devices)
+        if self.cache is not None:
+            self.cache.put(key, response)
+        return response
+
+    async def _post_with_retries(self, phrase, devices):
+        client = self._get_client()
+        payload = {"phrase": phrase, "devices": list(devices)}
+
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+
+            delay = None
+            try:
+                async with self._semaphore:
+                    response = await client.post("/v1/topRequests", json=payload)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                delay = retry_after_seconds(response)
+                if delay is not None:
+                    delay = min(delay, self.max_backoff)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+
+            # спим вне семафора, чтобы не занимать слот соединения
+            await asyncio.sleep(delay if delay is not None else backoff_delay(attempt))
@@ -4,13 +4,14 @@ import httpx
 import math
 import time
 import os
+import torch
 from sentence_transformers import SentenceTransformer, util
 
 OAUTH_TOKEN = os.getenv("OAUTH_TOKEN") 
 JSON_FILE = "products.json"
 
 class ProductAnalyzer:
-    def __init__(self):
+    def __init__(self, batch_size=64):
         print("Загрузка нейросети...")
         self.model = SentenceTransformer('intfloat/multilingual-e5-base')
         
@@ -25,11 +26,35 @@ class ProductAnalyzer:
 
         self.hype_pos = self.model.encode(["query: бестселлер хит продаж топ популярный выбор покупателей высокий рейтинг"], convert_to_tensor=True)
 
-        self.hype_neg = self.model.encode(["query: средний неизвестный нишевый базовый запасная часть обыденный"], convert_to_tensor=True) 
+        self.hype_neg = self.model.encode(["query: средний неизвестный нишевый базовый запасная часть обыденный"], convert_to_tensor=True)
 
-    def _get_score(self, embedding, pos, neg):
-        score = (util.cos_sim(embedding, pos).item() - util.cos_sim(embedding, neg).item()) * 100
-        return max(0, score + 5)
+        self.anchors = torch.cat([self.visual_pos, self.visual_neg,
+                                  self.novelty_pos, self.novelty_neg,
+                                  self.hype_pos, self.hype_neg])
+
+        self.batch_size = batch_size
+
+    def _encode_passages(self, texts):
+        if not texts:
+            return self.anchors.new_empty((0, self.anchors.shape[1]))
+
+        # сортируем по длине, чтобы в батч попадали строки похожей длины и было меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        chunks = []
+        for start in range(0, len(order), self.batch_size):
+            batch = [texts[i] for i in order[start:start + self.batch_size]]
+            chunks.append(self.model.encode(batch, batch_size=self.batch_size, convert_to_tensor=True))
+
+        sorted_emb = torch.cat(chunks)
+        embeddings = torch.empty_like(sorted_emb)
+        embeddings[torch.tensor(order, device=sorted_emb.device)] = sorted_emb
+        return embeddings
+
+    def _get_scores(self, embeddings):
+        # одна матрица (N, 6) косинусов против всех якорей: чётные колонки — pos, нечётные — neg
+        sims = util.cos_sim(embeddings, self.anchors)
+        scores = (sims[:, 0::2] - sims[:, 1::2]) * 100 + 5
+        return scores.clamp(min=0).mean(dim=1).tolist()
 
     async def get_trend_info(self, phrase_name):
         url = "https://api.wordstat.yandex.net/v1/topRequests"
@@ -69,6 +94,9 @@ class ProductAnalyzer:
         tasks = [self.get_trend_info(p['name']) for p in products]
         api_responses = await asyncio.gather(*tasks)
 
+        passages = [f"passage: {p['name']}. {p['description']}" for p in products]
+        m_scores = self._get_scores(self._encode_passages(passages))
+
         processed = []
         
         print(f"\n{'ТОВАР':<25} | {'СПРОС (Сумма)':<13} | {'СЧЕТ'}")
@@ -82,11 +110,7 @@ class ProductAnalyzer:
                 for item in json_data['topRequests']:
                     total_trend += item.get('count', 0)
             
-            desc_emb = self.model.encode(f"passage: {p['name']}. {p['description']}", convert_to_tensor=True)
-            
-            m_score = (self._get_score(desc_emb, self.visual_pos, self.visual_neg) + 
-                       self._get_score(desc_emb, self.novelty_pos, self.novelty_neg) + 
-                       self._get_score(desc_emb, self.hype_pos, self.hype_neg)) / 3
+            m_score = m_scores[i]
             
             margin = 0
             if p['price'] > 0: